@@ -45,6 +45,14 @@ export interface ISituacaoSerializer {
     comentario?: string | null;
 }
 
+export interface IMudancaDeSituacaoEmLoteSerializer {
+    tipo_de_situacao: any;
+    processos?: number[];
+    filtros?: string[];
+    data?: string;
+    comentario?: string;
+}
+
 export interface IProcessoSerializer {
     id?: number;
     criado_em?: string;
@@ -65,6 +73,36 @@ export interface IComentarioDocumentoSerializer {
     criado_em?: string;
 }
 
+export interface IEnvioDeDocumentoSerializer {
+    id?: string;
+    processo: any;
+    nome: string;
+    descricao?: string | null;
+    nome_do_arquivo: string;
+    tamanho?: number | null;
+    recebido?: number;
+    partes?: number;
+    crc32?: number;
+    criado_em?: string;
+}
+
+export interface ITarefaSerializer {
+    id?: string;
+    tipo: any;
+    parametros?: any;
+    entrada?: any;
+    estado?: any;
+    progresso?: number;
+    total?: number;
+    resultado?: any;
+    resultado_url?: any;
+    erro?: string;
+    tentativas?: number;
+    criado_em?: string;
+    iniciado_em?: string;
+    concluido_em?: string;
+}
+
 export interface IDocumentoSerializer {
     id?: number;
     processo: any;
@@ -73,6 +111,8 @@ export interface IDocumentoSerializer {
     descricao?: string | null;
     criado_em?: string;
     ultima_alteracao?: string;
+    thumbnail_url?: any;
+    preview_url?: any;
     comentarios?: IComentarioDocumentoSerializer[];
 }
 
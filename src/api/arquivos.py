@@ -0,0 +1,96 @@
+import os
+import shutil
+import threading
+import weakref
+
+from django.db import transaction
+
+# images generated next to a document file, see api.previews; they are removed and renamed with it
+SUFIXO_PREVIEW = ".preview.jpg"
+SUFIXO_THUMBNAIL = ".thumb.jpg"
+SUFIXOS_DERIVADOS = (SUFIXO_PREVIEW, SUFIXO_THUMBNAIL)
+
+
+class FilaDeArquivos:
+    """
+    Filesystem changes queued by a transaction and run, in order, once it
+    commits; a rollback discards them with the transaction. The images
+    derived from a file go with it. Removals of files inside a directory
+    that is removed as a whole are skipped, and the directories are
+    removed at the end.
+    """
+
+    def __init__(self):
+        self.operacoes = []
+        self.diretorios = []
+        self.executada = False
+
+    def remover(self, path):
+        self.operacoes.append(("remover", path, None))
+
+    def renomear(self, path, destino):
+        self.operacoes.append(("renomear", path, destino))
+
+    def remover_diretorio(self, diretorio):
+        self.diretorios.append(diretorio)
+
+    def __call__(self):
+        self.executada = True
+        diretorios = [os.path.join(os.path.abspath(diretorio), "") for diretorio in self.diretorios]
+        for operacao, path, destino in self.operacoes:
+            if operacao == "renomear":
+                for sufixo in ("",) + SUFIXOS_DERIVADOS:
+                    if os.path.exists(path + sufixo):
+                        os.rename(path + sufixo, destino + sufixo)
+            elif not any(os.path.abspath(path).startswith(diretorio) for diretorio in diretorios):
+                for sufixo in ("",) + SUFIXOS_DERIVADOS:
+                    if os.path.isfile(path + sufixo):
+                        os.remove(path + sufixo)
+        for diretorio in self.diretorios:
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+
+# the queue of each transaction and savepoint, per thread, see _enfileirar()
+_filas = threading.local()
+
+
+def _filas_registradas():
+    if not hasattr(_filas, "por_transacao"):
+        _filas.por_transacao = weakref.WeakValueDictionary()
+    return _filas.por_transacao
+
+
+def _enfileirar(metodo, *args):
+    """
+    Adds the change to the queue of the current transaction or savepoint,
+    registered once with `transaction.on_commit`. The registry only keeps
+    weak references, so a queue lives as long as its callback: a rollback
+    drops the callback and the queue with it, and the next transaction
+    starts a new one instead of adding to a queue that never runs.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        # outside a transaction it runs right away
+        fila = FilaDeArquivos()
+        getattr(fila, metodo)(*args)
+        transaction.on_commit(fila)
+        return
+    filas = _filas_registradas()
+    chave = (connection.alias, tuple(connection.savepoint_ids))
+    fila = filas.get(chave)
+    if fila is None or fila.executada:
+        fila = filas[chave] = FilaDeArquivos()
+        transaction.on_commit(fila)
+    getattr(fila, metodo)(*args)
+
+
+def remover_apos_commit(path):
+    _enfileirar("remover", path)
+
+
+def renomear_apos_commit(path, destino):
+    _enfileirar("renomear", path, destino)
+
+
+def remover_diretorio_apos_commit(diretorio):
+    _enfileirar("remover_diretorio", diretorio)
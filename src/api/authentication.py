@@ -0,0 +1,148 @@
+import binascii
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from hmac import compare_digest
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from knox import auth
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from knox.settings import CONSTANTS, knox_settings
+from knox.signals import token_expired
+from rest_framework import exceptions
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU cache, per process, of tokens whose digest was already verified.
+    Entries expire after `ttl` seconds, so a token revoked by another process
+    stops being accepted here after at most `ttl` seconds.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        # the raw token is not kept in memory
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        if self.ttl <= 0:
+            return None
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            auth_token, verified_at = entry
+            if time.monotonic() - verified_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return auth_token
+
+    def set(self, token, auth_token):
+        if self.ttl <= 0:
+            return
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (auth_token, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, digest=None, user_id=None):
+        with self._lock:
+            for key, (auth_token, verified_at) in list(self._entries.items()):
+                if auth_token.digest == digest or auth_token.user_id == user_id:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = VerifiedTokenCache(settings.TOKEN_CACHE_TTL, settings.TOKEN_CACHE_MAX_SIZE)
+
+
+class TokenAuthentication(auth.TokenAuthentication):
+    """
+    Knox authentication that serves repeated requests of the same token from
+    `token_cache`, without a query or a hash. On a miss, only the tokens with
+    the same `token_key` are read and only the presented token is checked for
+    expiry; expired tokens of other sessions are removed by `purge_auth_tokens`.
+    """
+
+    def authenticate_credentials(self, token):
+        msg = _("Invalid token.")
+        token = token.decode("utf-8")
+        auth_token = token_cache.get(token)
+        if auth_token is not None:
+            if auth_token.expiry is not None and auth_token.expiry < timezone.now():
+                token_cache.discard(digest=auth_token.digest)
+            else:
+                if knox_settings.AUTO_REFRESH and auth_token.expiry:
+                    self.renew_token(auth_token)
+                return self.validate_user(auth_token)
+
+        queryset = AuthToken.objects.select_related("user").filter(token_key=token[: CONSTANTS.TOKEN_KEY_LENGTH])
+        for auth_token in queryset:
+            if self._cleanup_token(auth_token):
+                continue
+            try:
+                digest = hash_token(token, auth_token.salt)
+            except (TypeError, binascii.Error):
+                raise exceptions.AuthenticationFailed(msg)
+            if compare_digest(digest, auth_token.digest):
+                if knox_settings.AUTO_REFRESH and auth_token.expiry:
+                    self.renew_token(auth_token)
+                token_cache.set(token, auth_token)
+                return self.validate_user(auth_token)
+        raise exceptions.AuthenticationFailed(msg)
+
+    def renew_token(self, auth_token):
+        """
+        Slides the expiry only when TOKEN_REFRESH_FRACTION of the TTL has passed
+        since the last refresh. The conditional UPDATE makes concurrent requests
+        of the same token, in any process, write the row only once.
+        """
+        ttl = knox_settings.TOKEN_TTL
+        interval = timedelta(
+            seconds=max(knox_settings.MIN_REFRESH_INTERVAL, ttl.total_seconds() * settings.TOKEN_REFRESH_FRACTION)
+        )
+        new_expiry = timezone.now() + ttl
+        if new_expiry - auth_token.expiry > interval:
+            AuthToken.objects.filter(digest=auth_token.digest, expiry__lt=new_expiry - interval).update(
+                expiry=new_expiry
+            )
+            auth_token.expiry = new_expiry
+
+    def _cleanup_token(self, auth_token):
+        if auth_token.expiry is not None and auth_token.expiry < timezone.now():
+            username = auth_token.user.get_username()
+            auth_token.delete()
+            token_expired.send(sender=self.__class__, username=username, source="auth_token")
+            return True
+        return False
+
+
+@receiver(post_delete, sender=AuthToken)
+def discard_cached_token_on_delete(sender, instance, **kwargs):
+    token_cache.discard(digest=instance.digest)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def discard_cached_tokens_on_user_change(sender, instance, **kwargs):
+    # is_active may have changed
+    token_cache.discard(user_id=instance.id)
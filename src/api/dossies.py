@@ -0,0 +1,268 @@
+import glob
+import hashlib
+import io
+import os
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image, ImageOps
+from PyPDF2 import PdfFileReader, PdfFileWriter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from api import models
+from api.previews import IMAGE_EXTENSIONS
+
+MARGEM = 1.5 * cm
+
+
+def diretorio_dos_dossies(processo_id):
+    return os.path.join(settings.DOSSIE_CACHE_ROOT, "processo_{0}".format(processo_id))
+
+
+def _data(valor):
+    return timezone.localtime(valor).strftime("%d/%m/%Y %H:%M:%S") if valor else ""
+
+
+def _conteudo(processo):
+    """
+    Returns the cover rows and the documentos of the dossier. Everything
+    the dossier shows is read here, so its hash changes with any of it.
+    """
+    campos = [
+        ("Data de Criação", _data(processo.criado_em)),
+        ("Processo", processo.identificacao),
+        ("Auto de Infração", processo.auto_infracao),
+        ("Reclamante", processo.reclamante),
+        ("Reclamada", processo.reclamada),
+        ("CPF/CNPJ", processo.cpf_cnpj),
+        ("Ficha de Atendimento", processo.ficha_de_atendimento),
+    ]
+    situacoes = [
+        (_data(situacao.data), models.tipos_de_situacao.get(situacao.tipo_de_situacao_id).nome, situacao.comentario)
+        for situacao in processo.situacoes.order_by("data", "id")
+    ]
+    documentos = list(processo.documentos.order_by("id").only("id", "nome", "descricao", "arquivo", "ultima_alteracao"))
+    return campos, situacoes, documentos
+
+
+def chave_do_dossie(campos, situacoes, documentos):
+    """
+    Hash of the document set, with the last change of each documento, and
+    of the cover, naming the cached file of a dossier.
+    """
+    chave = hashlib.sha256()
+    chave.update(repr((campos, situacoes)).encode())
+    for documento in documentos:
+        chave.update(
+            repr(
+                (documento.id, documento.nome, documento.descricao, documento.arquivo.name, documento.ultima_alteracao)
+            ).encode()
+        )
+    return chave.hexdigest()
+
+
+def _pdf_do_documento(path):
+    """
+    Returns a PdfFileReader with the pages of the document file at `path`:
+    the PDF itself, or an A4 page with the image fitted into it. Returns
+    None for the other files and for the PDFs that can not be read.
+    """
+    extensao = os.path.splitext(path)[1].lower()
+    try:
+        if extensao == ".pdf":
+            reader = PdfFileReader(path, strict=False)
+            if reader.isEncrypted and not reader.decrypt(""):
+                return None
+            reader.getNumPages()
+            return reader
+        if extensao in IMAGE_EXTENSIONS:
+            with Image.open(path) as imagem:
+                imagem = ImageOps.exif_transpose(imagem).convert("RGB")
+            largura, altura = A4[0] - 2 * MARGEM, A4[1] - 2 * MARGEM
+            escala = min(largura / imagem.width, altura / imagem.height)
+            output = io.BytesIO()
+            pagina = canvas.Canvas(output, pagesize=A4)
+            pagina.drawImage(
+                ImageReader(imagem),
+                (A4[0] - imagem.width * escala) / 2,
+                (A4[1] - imagem.height * escala) / 2,
+                imagem.width * escala,
+                imagem.height * escala,
+            )
+            pagina.save()
+            output.seek(0)
+            return PdfFileReader(output)
+    except Exception:
+        # damaged files are listed on the cover as not included
+        return None
+    return None
+
+
+def _paginas(intervalo, deslocamento):
+    if not intervalo:
+        return "não incluído"
+    primeira, ultima = intervalo[0] + deslocamento, intervalo[1] + deslocamento
+    return str(primeira) if primeira == ultima else "%d-%d" % (primeira, ultima)
+
+
+def _capa(processo, campos, situacoes, documentos, deslocamento):
+    """
+    Cover of the dossier. `documentos` are (documento, (first, last page
+    after the cover) or None), and `deslocamento` is the pages of the cover.
+    """
+    estilos = getSampleStyleSheet()
+    estilo_da_tabela = TableStyle(
+        [
+            ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+            ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ]
+    )
+
+    def paragrafo(texto):
+        return Paragraph(escape(str(texto or "")), estilos["BodyText"])
+
+    elementos = [
+        Paragraph(escape("Dossiê do processo %s" % (processo.identificacao or processo.id)), estilos["Title"]),
+        Table([[campo, paragrafo(valor)] for campo, valor in campos], colWidths=[5 * cm, None]),
+        Spacer(0, 0.5 * cm),
+        Paragraph("Situações", estilos["Heading2"]),
+    ]
+    if situacoes:
+        linhas = [["Data", "Situação", "Comentário"]]
+        linhas += [[data, paragrafo(nome), paragrafo(comentario)] for data, nome, comentario in situacoes]
+        elementos.append(Table(linhas, colWidths=[4 * cm, 5 * cm, None], repeatRows=1, style=estilo_da_tabela))
+    else:
+        elementos.append(Paragraph("Nenhuma situação.", estilos["BodyText"]))
+    elementos += [Spacer(0, 0.5 * cm), Paragraph("Documentos", estilos["Heading2"])]
+    if documentos:
+        linhas = [["Documento", "Descrição", "Páginas"]]
+        linhas += [
+            [paragrafo(documento.nome), paragrafo(documento.descricao), _paginas(intervalo, deslocamento)]
+            for documento, intervalo in documentos
+        ]
+        elementos.append(Table(linhas, colWidths=[6 * cm, None, 3 * cm], repeatRows=1, style=estilo_da_tabela))
+    else:
+        elementos.append(Paragraph("Nenhum documento.", estilos["BodyText"]))
+
+    output = io.BytesIO()
+    SimpleDocTemplate(
+        output, pagesize=A4, leftMargin=MARGEM, rightMargin=MARGEM, topMargin=MARGEM, bottomMargin=MARGEM
+    ).build(elementos)
+    output.seek(0)
+    return PdfFileReader(output)
+
+
+def _paginas_do_pdf(reader):
+    # the pages of a document, or None when PyPDF2 fails to read them
+    try:
+        return [reader.getPage(numero) for numero in range(reader.getNumPages())]
+    except Exception:
+        return None
+
+
+def _escrever_paginas(paginas, arquivo):
+    writer = PdfFileWriter()
+    for pagina in paginas:
+        writer.addPage(pagina)
+    writer.write(arquivo)
+
+
+def _pode_escrever(paginas):
+    # PyPDF2 only reads most objects of a page when it writes them
+    try:
+        _escrever_paginas(paginas, io.BytesIO())
+    except Exception:
+        return False
+    return True
+
+
+def _paginas_com_capa(processo, campos, situacoes, paginas_dos_documentos):
+    """
+    Returns the pages of the dossier: the cover, with the pages of each
+    documento, then the pages of the documentos. `paginas_dos_documentos`
+    are (documento, its pages or None).
+    """
+    intervalos = []
+    pagina = 1
+    for documento, paginas in paginas_dos_documentos:
+        if paginas:
+            intervalos.append((documento, (pagina, pagina + len(paginas) - 1)))
+            pagina += len(paginas)
+        else:
+            intervalos.append((documento, None))
+
+    capa = _capa(processo, campos, situacoes, intervalos, 1)
+    if capa.getNumPages() != 1:
+        # a longer cover pushes the documentos forward
+        capa = _capa(processo, campos, situacoes, intervalos, capa.getNumPages())
+    return _paginas_do_pdf(capa) + [pagina for _, paginas in paginas_dos_documentos if paginas for pagina in paginas]
+
+
+def _gerar_dossie(processo, campos, situacoes, documentos, path):
+    paginas_dos_documentos = []
+    for documento in documentos:
+        reader = None
+        if documento.arquivo and os.path.isfile(documento.arquivo.path):
+            reader = _pdf_do_documento(documento.arquivo.path)
+        paginas_dos_documentos.append((documento, _paginas_do_pdf(reader) if reader else None))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written under a temporary name, so concurrent builds never serve a half-written file
+    descritor, temporario = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(descritor, "wb") as arquivo:
+            try:
+                _escrever_paginas(_paginas_com_capa(processo, campos, situacoes, paginas_dos_documentos), arquivo)
+            except Exception:
+                # a documento failed while its pages were copied: each one is
+                # written alone to find it, and it is listed as not included
+                paginas_dos_documentos = [
+                    (documento, paginas if paginas and _pode_escrever(paginas) else None)
+                    for documento, paginas in paginas_dos_documentos
+                ]
+                arquivo.seek(0)
+                arquivo.truncate()
+                _escrever_paginas(_paginas_com_capa(processo, campos, situacoes, paginas_dos_documentos), arquivo)
+        os.replace(temporario, path)
+    except BaseException:
+        os.remove(temporario)
+        raise
+
+
+def dossie_do_processo(processo):
+    """
+    Returns the path of the PDF dossier of the processo: a cover with its
+    data, situations and documents, followed by the PDF documents and the
+    images, one per page. Other files are listed on the cover only.
+
+    The file is cached in DOSSIE_CACHE_ROOT under the hash of everything it
+    shows, so it is only built again after a change, and the stale ones of
+    the processo are removed then. Only the files written before this build
+    read the processo are stale: a concurrent build that read it later may
+    have written a newer one.
+    """
+    inicio = time.time()
+    campos, situacoes, documentos = _conteudo(processo)
+    diretorio = diretorio_dos_dossies(processo.id)
+    path = os.path.join(diretorio, chave_do_dossie(campos, situacoes, documentos) + ".pdf")
+    if not os.path.isfile(path):
+        _gerar_dossie(processo, campos, situacoes, documentos, path)
+        for antigo in glob.glob(os.path.join(diretorio, "*.pdf")):
+            try:
+                # a second of margin for the coarse timestamps of the files
+                if antigo != path and os.path.getmtime(antigo) < inicio - 1:
+                    os.remove(antigo)
+            except FileNotFoundError:
+                # removed by a concurrent build
+                pass
+    return path
@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from api import models
+from api.zipstream import CHUNK_SIZE
+
+
+class EnvioInvalido(Exception):
+    pass
+
+
+class ParteForaDeOrdem(EnvioInvalido):
+    pass
+
+
+class ArquivoTemporario(File):
+    """Temporary file of an upload, moved by the storage when saved, like a `TemporaryUploadedFile`."""
+
+    def __init__(self, path, name):
+        super().__init__(open(path, "rb"), name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def _receber_parte_em_arquivo(stream, tamanho, crc32):
+    """
+    Reads a part from `stream` in chunks into a temporary file of its own,
+    checking its size and CRC-32, and returns its path.
+    """
+    os.makedirs(settings.UPLOAD_TEMP_ROOT, exist_ok=True)
+    descritor, path = tempfile.mkstemp(suffix=".parte", dir=settings.UPLOAD_TEMP_ROOT)
+    try:
+        crc32_da_parte = 0
+        recebido = 0
+        with os.fdopen(descritor, "wb") as arquivo:
+            while recebido < tamanho:
+                data = stream.read(min(CHUNK_SIZE, tamanho - recebido))
+                if not data:
+                    break
+                arquivo.write(data)
+                crc32_da_parte = zlib.crc32(data, crc32_da_parte)
+                recebido += len(data)
+        if recebido != tamanho:
+            raise EnvioInvalido("A parte foi recebida incompleta.")
+        if crc32 is not None and crc32 != crc32_da_parte:
+            raise EnvioInvalido("O CRC-32 da parte não confere.")
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def receber_parte(envio_id, numero, stream, tamanho, crc32=None):
+    """
+    Appends part `numero` (starting at 1) of an upload, read from `stream`
+    in chunks, to its temporary file, and updates the running CRC-32.
+
+    The part is read from the network into a file of its own first, and
+    the session row is only locked to append it, so a slow client does not
+    hold the lock; a part sent twice at the same time is appended once. A
+    part already received is accepted again without being written, so
+    clients can resume after a lost response; a part after the next one is
+    refused. A part that fails midway is overwritten by the next attempt,
+    which starts at `recebido`.
+    """
+    if tamanho > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise EnvioInvalido("A parte excede %d bytes." % settings.UPLOAD_CHUNK_MAX_SIZE)
+    envio = models.EnvioDeDocumento.objects.get(id=envio_id)
+    if numero <= envio.partes:
+        return envio
+    if numero != envio.partes + 1:
+        raise ParteForaDeOrdem("A próxima parte esperada é a %d." % (envio.partes + 1))
+
+    parte = _receber_parte_em_arquivo(stream, tamanho, crc32)
+    try:
+        with transaction.atomic():
+            # checked again, another request may have appended it meanwhile
+            envio = models.EnvioDeDocumento.objects.select_for_update().get(id=envio_id)
+            if numero <= envio.partes:
+                return envio
+            if numero != envio.partes + 1:
+                raise ParteForaDeOrdem("A próxima parte esperada é a %d." % (envio.partes + 1))
+            if envio.tamanho is not None and envio.recebido + tamanho > envio.tamanho:
+                raise EnvioInvalido("O envio excede o tamanho informado.")
+
+            mode = "r+b" if os.path.exists(envio.caminho_temporario()) else "wb"
+            with open(envio.caminho_temporario(), mode) as arquivo, open(parte, "rb") as origem:
+                arquivo.seek(envio.recebido)
+                arquivo.truncate()
+                for data in iter(lambda: origem.read(CHUNK_SIZE), b""):
+                    arquivo.write(data)
+                    envio.crc32 = zlib.crc32(data, envio.crc32)
+
+            envio.recebido += tamanho
+            envio.partes = numero
+            envio.save(update_fields=["recebido", "partes", "crc32", "ultima_alteracao"])
+    finally:
+        os.remove(parte)
+    return envio
+
+
+def _link_temporario(path):
+    """Returns a new hard link to `path`, or a copy where links are not supported."""
+    link = "%s.%s" % (path, uuid.uuid4().hex)
+    try:
+        os.link(path, link)
+    except OSError:
+        shutil.copyfile(path, link)
+    return link
+
+
+@transaction.atomic
+def finalizar_envio(envio_id, crc32=None):
+    """
+    Creates the `Documento` of a complete upload from the temporary file,
+    which the storage moves instead of copying when it keeps the bytes,
+    and removes the upload session. The file itself is removed with the
+    session, once the transaction commits.
+    """
+    envio = models.EnvioDeDocumento.objects.select_for_update().get(id=envio_id)
+    if envio.tamanho is not None and envio.recebido != envio.tamanho:
+        raise EnvioInvalido("Foram recebidos %d de %d bytes." % (envio.recebido, envio.tamanho))
+    if crc32 is not None and crc32 != envio.crc32:
+        raise EnvioInvalido("O CRC-32 do arquivo não confere.")
+    if not os.path.isfile(envio.caminho_temporario()):
+        raise EnvioInvalido("Nenhuma parte foi recebida.")
+
+    # the storage gets a link to the temporary file, so a failed save leaves the upload intact
+    link = _link_temporario(envio.caminho_temporario())
+    documento = models.Documento(processo=envio.processo, nome=envio.nome, descricao=envio.descricao)
+    try:
+        with ArquivoTemporario(link, envio.nome_do_arquivo) as arquivo:
+            documento.arquivo = arquivo
+            documento.save()
+        envio.delete()
+    except BaseException:
+        documento.descartar_arquivo_novo()
+        raise
+    finally:
+        # left behind when the bytes were already stored
+        if os.path.exists(link):
+            os.remove(link)
+    return documento
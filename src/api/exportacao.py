@@ -0,0 +1,47 @@
+import xlsxwriter
+
+from api import models
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def exportar_processos(output, progresso=None):
+    """
+    Writes the spreadsheet of every processo to `output`. constant_memory
+    flushes each row to disk as soon as the next one starts. `progresso`,
+    if given, is called with (rows written, total) after each chunk.
+    """
+    book = xlsxwriter.Workbook(output, {"constant_memory": True})
+    sheet = book.add_worksheet("Processos")
+
+    processo_index = 1
+    sheet.write(processo_index, 1, "Data de Criação")
+    sheet.write(processo_index, 2, "Processo")
+    sheet.write(processo_index, 3, "Auto de Infração")
+    sheet.write(processo_index, 4, "Reclamante")
+    sheet.write(processo_index, 5, "Reclamada")
+    sheet.write(processo_index, 6, "CPF/CNPJ")
+    sheet.write(processo_index, 7, "Última Situação")
+    sheet.write(processo_index, 8, "Data da última situação")
+    sheet.write(processo_index, 9, "Ficha de Atendimento")
+    processo_index += 1
+    total = models.Processo.objects.count() if progresso else None
+    queryset = models.Processo.objects.select_related("situacao_atual").order_by("id")
+    for processo in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        ultima_situacao = processo.situacao_atual
+        sheet.write(processo_index, 1, processo.criado_em.strftime("%d/%m/%Y %H:%M:%S"))
+        sheet.write(processo_index, 2, processo.identificacao)
+        sheet.write(processo_index, 3, processo.auto_infracao)
+        sheet.write(processo_index, 4, processo.reclamante)
+        sheet.write(processo_index, 5, processo.reclamada)
+        sheet.write(processo_index, 6, processo.cpf_cnpj)
+        if ultima_situacao:
+            sheet.write(processo_index, 7, models.tipos_de_situacao.get(ultima_situacao.tipo_de_situacao_id).nome)
+            sheet.write(processo_index, 8, ultima_situacao.data.strftime("%d/%m/%Y %H:%M:%S"))
+        sheet.write(processo_index, 9, processo.ficha_de_atendimento)
+        processo_index += 1
+        if progresso and (processo_index - 2) % EXPORT_CHUNK_SIZE == 0:
+            progresso(processo_index - 2, total)
+    book.close()
+    if progresso:
+        progresso(processo_index - 2, total)
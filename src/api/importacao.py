@@ -0,0 +1,169 @@
+import time
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from api import models
+
+IMPORT_CHUNK_SIZE = 1000
+
+# columns of the imported spreadsheet, starting at column A, with the header on the first row
+COLUNA_CRIADO_EM = 0
+COLUNA_IDENTIFICACAO = 1
+COLUNA_AUTO_INFRACAO = 2
+COLUNA_RECLAMANTE = 3
+COLUNA_RECLAMADA = 4
+COLUNA_CPF_CNPJ = 5
+COLUNA_TIPO_DE_SITUACAO = 6
+COLUNA_SITUACAO_DATA = 7
+COLUNA_FICHA_DE_ATENDIMENTO = 8
+
+
+def formatar_cpf_cnpj(cpf_cnpj):
+    cpf_cnpj = str(cpf_cnpj)
+    # "999.999.999-99" 11
+    mask_cpf = "%s%s%s.%s%s%s.%s%s%s-%s%s"
+    # "99.999.999/9999-99" 14
+    mask_cnpj = "%s%s.%s%s%s.%s%s%s/%s%s%s%s-%s%s"
+    cpj_cnpj_onlynumbers = models.cpf_cnpj_somente_numeros(cpf_cnpj)
+    if len(cpj_cnpj_onlynumbers) == 11:
+        return mask_cpf % tuple(cpj_cnpj_onlynumbers)
+    elif len(cpj_cnpj_onlynumbers) == 14:
+        return mask_cnpj % tuple(cpj_cnpj_onlynumbers)
+    return cpf_cnpj
+
+
+def _valor(row, coluna):
+    if coluna < len(row):
+        return row[coluna]
+    return None
+
+
+def _data(valor):
+    if isinstance(valor, datetime):
+        if timezone.is_naive(valor):
+            return timezone.make_aware(valor)
+        return valor
+    return None
+
+
+def _tipo_de_situacao(nome):
+    """
+    Resolves a situation type by case-insensitive name from the process
+    cache, creating the missing ones at the end of the list.
+    """
+    tipo_de_situacao = models.tipos_de_situacao.por_nome(nome)
+    if not tipo_de_situacao:
+        tipo_de_situacao = models.Tipo_de_situacao.objects.create(
+            nome=nome, ordem=len(models.tipos_de_situacao.todos()) + 1
+        )
+    return tipo_de_situacao
+
+
+def _processo_da_linha(row):
+    processo = models.Processo()
+    criado_em = _data(_valor(row, COLUNA_CRIADO_EM))
+    if criado_em:
+        processo.criado_em = criado_em
+    for coluna, campo in (
+        (COLUNA_IDENTIFICACAO, "identificacao"),
+        (COLUNA_AUTO_INFRACAO, "auto_infracao"),
+        (COLUNA_RECLAMANTE, "reclamante"),
+        (COLUNA_RECLAMADA, "reclamada"),
+        (COLUNA_FICHA_DE_ATENDIMENTO, "ficha_de_atendimento"),
+    ):
+        valor = _valor(row, coluna)
+        if valor is not None and valor != "":
+            setattr(processo, campo, str(valor))
+    cpf_cnpj = _valor(row, COLUNA_CPF_CNPJ)
+    if cpf_cnpj:
+        processo.cpf_cnpj = formatar_cpf_cnpj(cpf_cnpj)
+        # bulk_create does not call Processo.save()
+        processo.cpf_cnpj_numeros = models.cpf_cnpj_somente_numeros(processo.cpf_cnpj)
+    return processo
+
+
+def _gravar(pendentes):
+    """
+    Inserts a chunk of (processo, situacao) pairs with one INSERT per table
+    and points each processo at its imported situation.
+    """
+    processos = models.Processo.objects.bulk_create([processo for processo, situacao in pendentes])
+    situacoes = []
+    for processo, situacao in zip(processos, [situacao for processo, situacao in pendentes]):
+        if situacao:
+            situacao.processo = processo
+            situacoes.append(situacao)
+    models.Situcacao.objects.bulk_create(situacoes)
+    models.incrementar_versao(models.Situcacao)
+    models.reconstruir_situacao_atual(
+        models.Processo.objects.filter(id__in=[situacao.processo_id for situacao in situacoes])
+    )
+    return len(processos)
+
+
+@transaction.atomic
+def importar_processos(arquivo, chunk_size=IMPORT_CHUNK_SIZE, progresso=None):
+    """
+    Imports the processos of a spreadsheet, streaming the rows and writing
+    them in chunks with `bulk_create`. Rows without identificacao are
+    ignored, invalid rows are reported in `erros` and not imported.
+    `progresso`, if given, is called with (rows read, total) after each
+    chunk.
+    """
+    inicio = time.monotonic()
+    wb = load_workbook(arquivo, read_only=True, data_only=True)
+    sheet = wb.active
+    # None when the file does not record its dimensions
+    total = sheet.max_row - 1 if sheet.max_row else None
+    models.tipos_de_situacao.sincronizar()
+
+    linhas = 0
+    importados = 0
+    ignorados = 0
+    erros = []
+    pendentes = []
+    for linha, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
+        linhas += 1
+        processo = _processo_da_linha(row)
+        if not processo.identificacao:
+            ignorados += 1
+            continue
+        try:
+            processo.clean_fields(exclude=["criado_em", "situacao_atual", "tipo_de_situacao_atual"])
+        except ValidationError as e:
+            erros.append({"linha": linha, "erros": e.message_dict})
+            continue
+
+        situacao = None
+        tipo_de_situacao_nome = _valor(row, COLUNA_TIPO_DE_SITUACAO)
+        if tipo_de_situacao_nome:
+            situacao = models.Situcacao(tipo_de_situacao=_tipo_de_situacao(str(tipo_de_situacao_nome)))
+            situacao_data = _data(_valor(row, COLUNA_SITUACAO_DATA))
+            if situacao_data:
+                situacao.data = situacao_data
+
+        pendentes.append((processo, situacao))
+        if len(pendentes) >= chunk_size:
+            importados += _gravar(pendentes)
+            pendentes = []
+            if progresso:
+                progresso(linhas, total)
+    if pendentes:
+        importados += _gravar(pendentes)
+    if progresso:
+        progresso(linhas, total)
+    wb.close()
+
+    segundos = time.monotonic() - inicio
+    return {
+        "linhas": linhas,
+        "importados": importados,
+        "ignorados": ignorados,
+        "erros": erros,
+        "segundos": round(segundos, 3),
+        "linhas_por_segundo": round(linhas / segundos, 1) if segundos else linhas,
+    }
@@ -0,0 +1,17 @@
+from django.db.models import CharField, TextField, Transform
+
+
+class Normalizado(Transform):
+    """
+    `lower(f_unaccent(...))`, the accent and case insensitive form of a text.
+    `f_unaccent` is the IMMUTABLE wrapper of `unaccent` created by migration
+    0012, so the expression can be indexed with gin_trgm_ops.
+    """
+
+    lookup_name = "normalizado"
+    template = "LOWER(F_UNACCENT(%(expressions)s))"
+    output_field = CharField()
+
+
+CharField.register_lookup(Normalizado)
+TextField.register_lookup(Normalizado)
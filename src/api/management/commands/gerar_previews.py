@@ -0,0 +1,30 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from api import models
+from api.previews import gerar_previews
+
+
+class Command(BaseCommand):
+    help = "Generates the missing previews and thumbnails of the document files, in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(), help="Parallel processes (default: number of CPUs)"
+        )
+        parser.add_argument("--sobrescrever", action="store_true", help="Generate again the existing ones")
+
+    def handle(self, *args, **options):
+        # documentos with the same content share the file and its previews
+        nomes = models.Documento.objects.exclude(arquivo="").order_by().values_list("arquivo", flat=True).distinct()
+        storage = models.Documento._meta.get_field("arquivo").storage
+        paths = [storage.path(nome) for nome in nomes.iterator()]
+
+        with ProcessPoolExecutor(max_workers=max(options["workers"], 1)) as executor:
+            gerados = sum(executor.map(gerar_previews, paths, [options["sobrescrever"]] * len(paths), chunksize=16))
+        if gerados:
+            # the documentos now have preview URLs, their ETags change
+            models.incrementar_versao(models.Documento)
+        self.stdout.write(self.style.SUCCESS("%d de %d arquivos com previews gerados" % (gerados, len(paths))))
@@ -0,0 +1,72 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, connections
+
+from api import tarefas
+
+
+def processar(intervalo, sair_quando_vazia):
+    """
+    Runs jobs until SIGTERM, letting the current one finish. Without jobs
+    it checks the queue every `intervalo` seconds.
+    """
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: parar.set())
+    while not parar.is_set():
+        try:
+            tarefas.recuperar_tarefas_abandonadas()
+            tarefa = tarefas.reservar_tarefa()
+            if tarefa is None:
+                if sair_quando_vazia:
+                    return
+                parar.wait(intervalo)
+                continue
+            tarefas.executar_tarefa(tarefa)
+        except DatabaseError:
+            # the database restarted, try again with a new connection; a job
+            # whose end was not saved is queued again once it times out
+            connection.close()
+            parar.wait(intervalo)
+
+
+class Command(BaseCommand):
+    help = "Runs the queued jobs (api.models.Tarefa) in parallel processes, until SIGTERM"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.TAREFA_WORKERS,
+            help="Jobs run at the same time (default: TAREFA_WORKERS)",
+        )
+        parser.add_argument(
+            "--intervalo", type=float, default=2, help="Seconds between checks of an empty queue (default: 2)"
+        )
+        parser.add_argument("--sair-quando-vazia", action="store_true", help="Stop once the queue is empty")
+
+    def handle(self, *args, **options):
+        argumentos = (options["intervalo"], options["sair_quando_vazia"])
+        workers = max(options["workers"], 1)
+        if workers == 1:
+            processar(*argumentos)
+            return
+
+        # the forked processes must not share the connection of the parent
+        connections.close_all()
+        contexto = multiprocessing.get_context("fork")
+        processos = [contexto.Process(target=processar, args=argumentos) for _ in range(workers)]
+        for processo in processos:
+            processo.start()
+
+        def terminar(signum, frame):
+            for processo in processos:
+                processo.terminate()
+
+        signal.signal(signal.SIGTERM, terminar)
+        signal.signal(signal.SIGINT, terminar)
+        for processo in processos:
+            processo.join()
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+from knox.models import AuthToken
+
+
+class Command(BaseCommand):
+    help = "Deletes expired authentication tokens and keeps at most the newest N tokens of each user"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-por-usuario",
+            type=int,
+            default=settings.TOKEN_MAX_PER_USER,
+            help="Tokens kept per user, 0 keeps all (default: TOKEN_MAX_PER_USER)",
+        )
+
+    def handle(self, *args, **options):
+        expirados, _ = AuthToken.objects.filter(expiry__lt=timezone.now()).delete()
+
+        excedentes = 0
+        max_por_usuario = options["max_por_usuario"]
+        if max_por_usuario > 0:
+            usuarios = (
+                AuthToken.objects.order_by()
+                .values("user_id")
+                .annotate(total=Count("digest"))
+                .filter(total__gt=max_por_usuario)
+                .values_list("user_id", flat=True)
+            )
+            for user_id in usuarios:
+                manter = AuthToken.objects.filter(user_id=user_id).order_by("-created")[:max_por_usuario]
+                removidos, _ = (
+                    AuthToken.objects.filter(user_id=user_id)
+                    .exclude(digest__in=list(manter.values_list("digest", flat=True)))
+                    .delete()
+                )
+                excedentes += removidos
+
+        self.stdout.write(self.style.SUCCESS("%d tokens expirados e %d excedentes removidos" % (expirados, excedentes)))
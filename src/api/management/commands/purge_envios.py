@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import models
+
+
+class Command(BaseCommand):
+    help = "Deletes the chunked uploads, and their temporary files, that were not changed for some hours"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--horas", type=int, default=24, help="Hours without a new part (default: 24)")
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(hours=options["horas"])
+        removidos = 0
+        # one by one, so the temporary files are removed by the post_delete signal
+        for envio in models.EnvioDeDocumento.objects.filter(ultima_alteracao__lt=limite).iterator():
+            envio.delete()
+            removidos += 1
+        self.stdout.write(self.style.SUCCESS("%d envios abandonados removidos" % removidos))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import models
+
+
+class Command(BaseCommand):
+    help = "Deletes the finished jobs, and their files, some hours after they finished"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--horas", type=int, default=24, help="Hours since the job finished (default: 24)")
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(hours=options["horas"])
+        removidas = 0
+        # one by one, so the files are removed by the post_delete signal
+        for tarefa in models.Tarefa.objects.filter(
+            estado__in=[models.Tarefa.CONCLUIDA, models.Tarefa.FALHOU], concluido_em__lt=limite
+        ).iterator():
+            tarefa.delete()
+            removidas += 1
+        self.stdout.write(self.style.SUCCESS("%d tarefas concluídas removidas" % removidas))
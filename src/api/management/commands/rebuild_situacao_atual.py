@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import models
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the current situation pointer (situacao_atual) of every processo"
+
+    def add_arguments(self, parser):
+        parser.add_argument("processo_ids", nargs="*", type=int, help="Only rebuild these processos")
+
+    def handle(self, *args, **options):
+        queryset = models.Processo.objects.all()
+        if options["processo_ids"]:
+            queryset = queryset.filter(id__in=options["processo_ids"])
+        with transaction.atomic():
+            updated = models.reconstruir_situacao_atual(queryset)
+        self.stdout.write(self.style.SUCCESS("%d processos atualizados" % updated))
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.5 on 2026-10-18 10:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def preencher_situacao_atual(apps, schema_editor):
+    Processo = apps.get_model('api', 'Processo')
+    Situcacao = apps.get_model('api', 'Situcacao')
+    ultimas = Situcacao.objects.filter(processo=models.OuterRef('pk')).order_by('-data', '-id')
+    Processo.objects.update(
+        situacao_atual=models.Subquery(ultimas.values('id')[:1]),
+        tipo_de_situacao_atual=models.Subquery(ultimas.values('tipo_de_situacao')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_documento_descricao'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='documento',
+            options={'ordering': ['processo', '-ultima_alteracao', 'id']},
+        ),
+        migrations.AlterModelOptions(
+            name='situcacao',
+            options={'ordering': ['processo', '-data', 'id'], 'verbose_name_plural': 'Situcacoes'},
+        ),
+        migrations.AddField(
+            model_name='processo',
+            name='situacao_atual',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.situcacao'),
+        ),
+        migrations.AddField(
+            model_name='processo',
+            name='tipo_de_situacao_atual',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.tipo_de_situacao'),
+        ),
+        migrations.AlterField(
+            model_name='processo',
+            name='criado_em',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='situcacao',
+            index=models.Index(fields=['processo', '-data', '-id'], name='situacao_processo_data_idx'),
+        ),
+        migrations.RunPython(preencher_situacao_atual, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:03
+
+import api.lookups
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+# unaccent() is only STABLE, an IMMUTABLE wrapper is required to use it in an index
+CREATE_F_UNACCENT = '''
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+$func$ SELECT public.unaccent('public.unaccent', $1) $func$
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_processo_situacao_atual'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_F_UNACCENT, 'DROP FUNCTION IF EXISTS f_unaccent(text);'),
+        migrations.AddIndex(
+            model_name='processo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(api.lookups.Normalizado('identificacao'), name='gin_trgm_ops'), name='processo_identificacao_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='processo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(api.lookups.Normalizado('auto_infracao'), name='gin_trgm_ops'), name='processo_auto_infracao_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='processo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(api.lookups.Normalizado('reclamante'), name='gin_trgm_ops'), name='processo_reclamante_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='processo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(api.lookups.Normalizado('reclamada'), name='gin_trgm_ops'), name='processo_reclamada_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='processo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(api.lookups.Normalizado('cpf_cnpj'), name='gin_trgm_ops'), name='processo_cpf_cnpj_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='processo',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(api.lookups.Normalizado('ficha_de_atendimento'), name='gin_trgm_ops'), name='processo_ficha_trgm'),
+        ),
+    ]
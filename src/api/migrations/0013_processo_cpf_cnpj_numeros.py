@@ -0,0 +1,28 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+def preencher_cpf_cnpj_numeros(apps, schema_editor):
+    Processo = apps.get_model('api', 'Processo')
+    Processo.objects.exclude(cpf_cnpj__isnull=True).exclude(cpf_cnpj='').update(
+        cpf_cnpj_numeros=models.Func(
+            models.F('cpf_cnpj'), models.Value('[^0-9]'), models.Value(''), models.Value('g'), function='REGEXP_REPLACE'
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_processo_busca_normalizada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processo',
+            name='cpf_cnpj_numeros',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(preencher_cpf_cnpj_numeros, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_processo_cpf_cnpj_numeros'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='processo',
+            index=models.Index(fields=['criado_em', 'id'], name='processo_criado_em_idx'),
+        ),
+    ]
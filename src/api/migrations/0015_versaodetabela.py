@@ -0,0 +1,26 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:08
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_processo_criado_em_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoDeTabela',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tabela', models.CharField(max_length=100, unique=True)),
+                ('versao', models.PositiveBigIntegerField(default=0)),
+                ('alterado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'Versoes de tabelas',
+            },
+        ),
+    ]
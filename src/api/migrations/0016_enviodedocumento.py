@@ -0,0 +1,38 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0015_versaodetabela'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvioDeDocumento',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('nome', models.CharField(max_length=255)),
+                ('descricao', models.CharField(blank=True, default='', max_length=255, null=True)),
+                ('nome_do_arquivo', models.CharField(max_length=255)),
+                ('tamanho', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('recebido', models.PositiveBigIntegerField(default=0, editable=False)),
+                ('partes', models.PositiveIntegerField(default=0, editable=False)),
+                ('crc32', models.PositiveBigIntegerField(default=0, editable=False)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('ultima_alteracao', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='envios_de_documentos', to=settings.AUTH_USER_MODEL)),
+                ('processo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='envios_de_documentos', to='api.processo')),
+            ],
+            options={
+                'verbose_name_plural': 'Envios de documentos',
+                'ordering': ['criado_em', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:18
+
+import api.models
+from django.core.files.storage import default_storage
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+import hashlib
+import os
+import shutil
+
+
+def deduplicar_documentos(apps, schema_editor):
+    """
+    Points every documento at the shared copy of its bytes. The first copy
+    of each content is linked into documentos/sha256/ and the old files are
+    removed only after the migration commits.
+    """
+    Documento = apps.get_model('api', 'Documento')
+    ConteudoDeDocumento = apps.get_model('api', 'ConteudoDeDocumento')
+    substituidos = []
+    for documento in Documento.objects.filter(conteudo__isnull=True).exclude(arquivo='').order_by('id').iterator():
+        path = documento.arquivo.path
+        if not os.path.isfile(path):
+            continue
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as arquivo:
+            for chunk in iter(lambda: arquivo.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        sha256 = sha256.hexdigest()
+
+        conteudo = ConteudoDeDocumento.objects.filter(sha256=sha256).first()
+        if conteudo:
+            ConteudoDeDocumento.objects.filter(id=conteudo.id).update(referencias=models.F('referencias') + 1)
+        else:
+            nome = default_storage.get_available_name(
+                'documentos/sha256/{0}{1}'.format(sha256, os.path.splitext(path)[1].lower())
+            )
+            destino = default_storage.path(nome)
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            try:
+                os.link(path, destino)
+            except OSError:
+                shutil.copy2(path, destino)
+            conteudo = ConteudoDeDocumento.objects.create(
+                sha256=sha256, arquivo=nome, tamanho=os.path.getsize(path), referencias=1
+            )
+        # update() keeps ultima_alteracao
+        Documento.objects.filter(id=documento.id).update(conteudo=conteudo, arquivo=conteudo.arquivo.name)
+        substituidos.append(path)
+
+    def remover_substituidos():
+        for path in substituidos:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    transaction.on_commit(remover_substituidos)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_enviodedocumento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConteudoDeDocumento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('arquivo', models.FileField(upload_to=api.models.conteudo_directory_path)),
+                ('tamanho', models.PositiveBigIntegerField(default=0)),
+                ('referencias', models.PositiveIntegerField(default=0)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Conteudos de documentos',
+            },
+        ),
+        migrations.AddField(
+            model_name='documento',
+            name='conteudo',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documentos', to='api.conteudodedocumento'),
+        ),
+        # the shared files can not be split back into one file per documento
+        migrations.RunPython(deduplicar_documentos),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:26
+
+import api.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0017_conteudodedocumento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarefa',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('tipo', models.CharField(max_length=50)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('entrada', models.FileField(blank=True, default='', upload_to=api.models.tarefa_directory_path)),
+                ('estado', models.CharField(choices=[('pendente', 'Pendente'), ('executando', 'Executando'), ('concluida', 'Concluída'), ('falhou', 'Falhou')], default='pendente', max_length=20)),
+                ('progresso', models.PositiveBigIntegerField(default=0)),
+                ('total', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('arquivo', models.FileField(blank=True, default='', upload_to=api.models.tarefa_directory_path)),
+                ('erro', models.TextField(blank=True, default='')),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('iniciado_em', models.DateTimeField(blank=True, null=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('ultima_alteracao', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tarefas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['criado_em', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tarefa',
+            index=models.Index(fields=['estado', 'criado_em'], name='tarefa_estado_criado_em_idx'),
+        ),
+    ]
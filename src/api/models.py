@@ -1,13 +1,33 @@
 from datetime import datetime
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
 from django.utils import timezone
+import hashlib
 import os
+import re
+import threading
+import time
+import uuid
+import weakref
 from django.dispatch import receiver
 
+from api.arquivos import remover_apos_commit, remover_diretorio_apos_commit, renomear_apos_commit
+from api.lookups import Normalizado
+from api.previews import fila_de_previews
+
+
+USERNAME_SISTEMA = "Sistema"
+
+# id of the system user, cached per process by get_system_user_id()
+_system_user_id = None
+
 
 def get_system_user():
-    username_system = "Sistema"
+    username_system = USERNAME_SISTEMA
     first_name = "Sistema"
     user_sistema = User.objects.filter(username=username_system).first()
     if user_sistema:
@@ -21,6 +41,94 @@ def get_system_user():
         # )
 
 
+def get_system_user_id():
+    global _system_user_id
+    if _system_user_id is None:
+        _system_user_id = get_system_user().id
+    return _system_user_id
+
+
+def invalidate_system_user_cache():
+    global _system_user_id
+    _system_user_id = None
+
+
+@receiver(models.signals.post_save, sender=User)
+@receiver(models.signals.post_delete, sender=User)
+def invalidate_system_user_on_change(sender, instance, **kwargs):
+    if instance.username == USERNAME_SISTEMA or instance.id == _system_user_id:
+        invalidate_system_user_cache()
+
+
+class VersaoDeTabela(models.Model):
+    """
+    Version counter of a model's table, shared by every process. It is
+    incremented whenever the rows change, so caches keyed by the version
+    are invalidated in all workers.
+    """
+
+    tabela = models.CharField(max_length=100, unique=True)
+    versao = models.PositiveBigIntegerField(default=0)
+    alterado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = "Versoes de tabelas"
+
+    def __str__(self):
+        return str(self.tabela) + " - " + str(self.versao)
+
+
+def versao_da_tabela(model):
+    versao = VersaoDeTabela.objects.filter(tabela=model._meta.label_lower).values_list("versao", flat=True).first()
+    return versao or 0
+
+
+def versoes_das_tabelas(model_list):
+    """Returns the `VersaoDeTabela` of each model, in one query, keyed by table."""
+    tabelas = [model._meta.label_lower for model in model_list]
+    return {versao.tabela: versao for versao in VersaoDeTabela.objects.filter(tabela__in=tabelas)}
+
+
+# tables waiting for the commit to have their version incremented, per thread, see incrementar_versao()
+_versoes_pendentes = threading.local()
+
+
+def incrementar_versao(*model_list):
+    """
+    Increments the version of the tables of `model_list` once the current
+    transaction commits, or right away outside one. The shared version rows
+    are not locked by the writers until their commit, and each table is
+    incremented once however many rows the transaction wrote.
+    """
+    pendentes = getattr(_versoes_pendentes, "tabelas", None)
+    if pendentes is None:
+        pendentes = _versoes_pendentes.tabelas = set()
+    pendentes.update(model._meta.label_lower for model in model_list)
+    # every call registers its own callback, the first one run after the commit
+    # takes the whole set and the others find it empty; tables of a transaction
+    # rolled back are incremented with the next commit, which is harmless
+    transaction.on_commit(lambda: _gravar_versoes(pendentes))
+
+
+def _gravar_versoes(pendentes):
+    tabelas = set(pendentes)
+    pendentes.clear()
+    if not tabelas:
+        return
+    agora = timezone.now()
+    atualizadas = VersaoDeTabela.objects.filter(tabela__in=tabelas).update(versao=F("versao") + 1, alterado_em=agora)
+    if atualizadas < len(tabelas):
+        # first change of a table
+        novas = tabelas - set(VersaoDeTabela.objects.filter(tabela__in=tabelas).values_list("tabela", flat=True))
+        VersaoDeTabela.objects.bulk_create([VersaoDeTabela(tabela=tabela) for tabela in novas], ignore_conflicts=True)
+        VersaoDeTabela.objects.filter(tabela__in=novas).update(versao=F("versao") + 1, alterado_em=agora)
+
+
+def cpf_cnpj_somente_numeros(cpf_cnpj):
+    # only ASCII digits, the same as regexp_replace(cpf_cnpj, '[^0-9]', '', 'g') in migration 0013
+    return re.sub(r"[^0-9]", "", cpf_cnpj or "")
+
+
 class Profile(models.Model):
 
     user = models.OneToOneField(User, related_name="profile", on_delete=models.CASCADE, unique=True)
@@ -30,6 +138,10 @@ class Profile(models.Model):
         return str(self.user.username)
 
 
+# set by atualizar_situacao_atual() and reconstruir_situacao_atual(), not by Processo.save()
+CAMPOS_DE_SITUACAO_ATUAL = ("situacao_atual", "tipo_de_situacao_atual")
+
+
 class Processo(models.Model):
     criado_em = models.DateTimeField(default=timezone.now, blank=True)
     identificacao = models.CharField(max_length=255, null=True, blank=True, default="")
@@ -37,16 +149,52 @@ class Processo(models.Model):
     reclamante = models.CharField(max_length=255, null=True, blank=True, default="")
     reclamada = models.CharField(max_length=255, null=True, blank=True, default="")
     cpf_cnpj = models.CharField(max_length=255, null=True, blank=True, default="")
+    cpf_cnpj_numeros = models.CharField(max_length=255, blank=True, default="", editable=False, db_index=True)
     ficha_de_atendimento = models.CharField(max_length=255, null=True, blank=True, default="")
+    situacao_atual = models.ForeignKey(
+        "Situcacao", related_name="+", null=True, blank=True, editable=False, on_delete=models.SET_NULL
+    )
+    tipo_de_situacao_atual = models.ForeignKey(
+        "Tipo_de_situacao", related_name="+", null=True, blank=True, editable=False, on_delete=models.SET_NULL
+    )
 
     class Meta:
         ordering = ["id"]
+        indexes = [
+            models.Index(fields=["criado_em", "id"], name="processo_criado_em_idx"),
+            GinIndex(OpClass(Normalizado("identificacao"), name="gin_trgm_ops"), name="processo_identificacao_trgm"),
+            GinIndex(OpClass(Normalizado("auto_infracao"), name="gin_trgm_ops"), name="processo_auto_infracao_trgm"),
+            GinIndex(OpClass(Normalizado("reclamante"), name="gin_trgm_ops"), name="processo_reclamante_trgm"),
+            GinIndex(OpClass(Normalizado("reclamada"), name="gin_trgm_ops"), name="processo_reclamada_trgm"),
+            GinIndex(OpClass(Normalizado("cpf_cnpj"), name="gin_trgm_ops"), name="processo_cpf_cnpj_trgm"),
+            GinIndex(OpClass(Normalizado("ficha_de_atendimento"), name="gin_trgm_ops"), name="processo_ficha_trgm"),
+        ]
 
     def __str__(self):
         return str(self.identificacao) + " - " + str(self.criado_em)
 
+    def save(self, *args, **kwargs):
+        self.cpf_cnpj_numeros = cpf_cnpj_somente_numeros(self.cpf_cnpj)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None and self.pk is not None and not self._state.adding and not kwargs.get("force_insert"):
+            # a full save of an existing processo leaves out the current situation
+            # pointers, which a situation committed after this instance was read may
+            # have moved; only atualizar_situacao_atual() and
+            # reconstruir_situacao_atual() write them
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in CAMPOS_DE_SITUACAO_ATUAL
+                and field.attname not in deferred
+            ]
+        elif update_fields is not None and "cpf_cnpj" in update_fields:
+            kwargs["update_fields"] = set(update_fields) | {"cpf_cnpj_numeros"}
+        super().save(*args, **kwargs)
+
     def ultima_situacao(self):
-        return self.situacoes.order_by("-data").all().first()
+        return self.situacao_atual
 
 
 class Tipo_de_situacao(models.Model):
@@ -63,6 +211,97 @@ class Tipo_de_situacao(models.Model):
         return str(self.ordem) + " - " + str(self.nome)
 
 
+class CacheDeTiposDeSituacao:
+    """
+    Copy of the whole Tipo_de_situacao table kept by each process, by id and
+    by case-folded name. The table version is checked at most every
+    `intervalo` seconds and the rows are reloaded only when it changed, so
+    a change made by another worker is seen after at most `intervalo`
+    seconds and a change made by this process right away.
+    """
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._versao = None
+        self._verificado_em = 0
+        self._tipos = []
+        self._por_id = {}
+        self._por_nome = {}
+
+    def sincronizar(self, forcar=True, recarregar=False):
+        if not forcar and self._versao is not None and time.monotonic() - self._verificado_em < self.intervalo:
+            return
+        with self._lock:
+            verificado_em = time.monotonic()
+            versao = versao_da_tabela(Tipo_de_situacao)
+            if recarregar or versao != self._versao:
+                tipos = list(Tipo_de_situacao.objects.all())
+                por_nome = {}
+                for tipo_de_situacao in tipos:
+                    por_nome.setdefault(tipo_de_situacao.nome.casefold(), tipo_de_situacao)
+                self._tipos, self._por_id, self._por_nome = tipos, {tipo.id: tipo for tipo in tipos}, por_nome
+                self._versao = versao
+            self._verificado_em = verificado_em
+
+    def invalidar(self):
+        self._versao = None
+
+    def todos(self):
+        self.sincronizar(forcar=False)
+        return list(self._tipos)
+
+    def get(self, id):
+        self.sincronizar(forcar=False)
+        if id not in self._por_id:
+            # created by another process since the last check, maybe committed
+            # before its version was incremented
+            self.sincronizar(recarregar=True)
+        return self._por_id.get(id)
+
+    def por_nome(self, nome):
+        self.sincronizar(forcar=False)
+        return self._por_nome.get(nome.casefold())
+
+
+tipos_de_situacao = CacheDeTiposDeSituacao(settings.TIPO_DE_SITUACAO_CACHE_TTL)
+
+
+@receiver(models.signals.post_save, sender=Tipo_de_situacao)
+@receiver(models.signals.post_delete, sender=Tipo_de_situacao)
+def invalidar_tipos_de_situacao_on_change(sender, instance, **kwargs):
+    tipos_de_situacao.invalidar()
+    # the rows read before the commit may be outdated
+    transaction.on_commit(tipos_de_situacao.invalidar)
+
+
+class OrdemInvalida(Exception):
+    pass
+
+
+def reordenar_tipos_de_situacao(ids):
+    """
+    Sets the `ordem` of every situation type to its position, starting at 1,
+    in `ids`, which must list all of them once. The rows are locked in id
+    order, so concurrent reorders wait for each other instead of
+    deadlocking, and then updated with a single UPDATE ... CASE.
+    """
+    with transaction.atomic():
+        existentes = list(Tipo_de_situacao.objects.select_for_update().order_by("id").values_list("id", flat=True))
+        if len(ids) != len(set(ids)) or set(ids) != set(existentes):
+            raise OrdemInvalida("A ordem deve conter todos os tipos de situação, uma vez cada.")
+        Tipo_de_situacao.objects.update(
+            ordem=Case(
+                *[When(id=id, then=Value(ordem)) for ordem, id in enumerate(ids, start=1)],
+                output_field=models.PositiveSmallIntegerField(),
+            )
+        )
+        incrementar_versao(Tipo_de_situacao)
+        # update() does not send the signals
+        tipos_de_situacao.invalidar()
+        transaction.on_commit(tipos_de_situacao.invalidar)
+
+
 class Situcacao(models.Model):
     processo = models.ForeignKey(Processo, related_name="situacoes", on_delete=models.CASCADE)
     tipo_de_situacao = models.ForeignKey(Tipo_de_situacao, related_name="situacoes", on_delete=models.CASCADE)
@@ -72,18 +311,155 @@ class Situcacao(models.Model):
     class Meta:
         ordering = ["processo", "-data", "id"]
         verbose_name_plural = "Situcacoes"
+        indexes = [models.Index(fields=["processo", "-data", "-id"], name="situacao_processo_data_idx")]
 
     def __str__(self):
         return str(self.processo) + " - " + str(self.tipo_de_situacao) + " - " + str(self.data)
 
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        # the insert and the update of Processo.situacao_atual commit together
+        super().save(*args, **kwargs)
+
+
+def atualizar_situacao_atual(processo_id):
+    """
+    Recalculates `Processo.situacao_atual` and `Processo.tipo_de_situacao_atual`
+    for one processo, locking its row so concurrent changes are serialized.
+    """
+    with transaction.atomic():
+        if not Processo.objects.select_for_update().filter(pk=processo_id).exists():
+            return
+        situacao = (
+            Situcacao.objects.filter(processo_id=processo_id)
+            .order_by("-data", "-id")
+            .only("id", "tipo_de_situacao_id")
+            .first()
+        )
+        Processo.objects.filter(pk=processo_id).update(
+            situacao_atual=situacao,
+            tipo_de_situacao_atual_id=situacao.tipo_de_situacao_id if situacao else None,
+        )
+        incrementar_versao(Processo)
+
+
+def reconstruir_situacao_atual(queryset=None):
+    """
+    Rebuilds the current situation pointers of every processo in `queryset`
+    with a single UPDATE statement. Returns the number of rows updated.
+    """
+    if queryset is None:
+        queryset = Processo.objects.all()
+    ultimas = Situcacao.objects.filter(processo=OuterRef("pk")).order_by("-data", "-id")
+    atualizados = queryset.update(
+        situacao_atual=Subquery(ultimas.values("id")[:1]),
+        tipo_de_situacao_atual=Subquery(ultimas.values("tipo_de_situacao")[:1]),
+    )
+    incrementar_versao(Processo)
+    return atualizados
+
+
+@transaction.atomic
+def mudar_situacao_em_lote(processo_ids, tipo_de_situacao, data=None, comentario=""):
+    """
+    Adds a situation of `tipo_de_situacao` to every processo of
+    `processo_ids` that exists, with one INSERT, one UPDATE of the current
+    situations and the "Nova Situação" comments of all their documentos in
+    one batch. Returns the new situations, ordered by processo.
+
+    The processos are locked, in id order, like `atualizar_situacao_atual`
+    does one by one, so concurrent changes of the same processos wait.
+    """
+    ids = list(
+        Processo.objects.select_for_update().filter(id__in=processo_ids).order_by("id").values_list("id", flat=True)
+    )
+    data = data or timezone.now()
+    situacoes = Situcacao.objects.bulk_create(
+        [
+            Situcacao(processo_id=processo_id, tipo_de_situacao=tipo_de_situacao, data=data, comentario=comentario)
+            for processo_id in ids
+        ],
+        batch_size=1000,
+    )
+    if situacoes:
+        # bulk_create does not send the signals of Situcacao.save()
+        incrementar_versao(Situcacao)
+        reconstruir_situacao_atual(Processo.objects.filter(id__in=ids))
+        comentar_novas_situacoes(situacoes)
+    return situacoes
+
+
+# processos being deleted in this thread, by id, see auto_mark_processo_on_delete()
+_processos_em_exclusao = threading.local()
+
+
+def processos_em_exclusao():
+    if not hasattr(_processos_em_exclusao, "instancias"):
+        # weak, so a delete that fails does not leave its processos marked
+        _processos_em_exclusao.instancias = weakref.WeakValueDictionary()
+    return _processos_em_exclusao.instancias
+
+
+@receiver(models.signals.post_save, sender=Situcacao)
+@receiver(models.signals.post_delete, sender=Situcacao)
+def update_situacao_atual_on_change(sender, instance, **kwargs):
+    """
+    Keeps `Processo.situacao_atual` pointing at the latest `Situcacao`
+    when a situation is created, edited or deleted, except when it is
+    deleted with its processo.
+    """
+    if kwargs.get("raw", False):
+        return
+    if kwargs.get("signal") is models.signals.post_delete and instance.processo_id in processos_em_exclusao():
+        return
+    atualizar_situacao_atual(instance.processo_id)
+    # the situation may have been moved to another processo
+    antigos = Processo.objects.filter(situacao_atual_id=instance.id).exclude(pk=instance.processo_id)
+    for processo_id in antigos.values_list("id", flat=True):
+        atualizar_situacao_atual(processo_id)
+
+
+def comentar_novas_situacoes(situacoes):
+    """
+    Adds the "Nova Situação" comment to every documento of the processos of
+    `situacoes`, once the current transaction commits, with one SELECT and
+    one bulk INSERT for the whole batch.
+    """
+    comentarios_por_processo = {}
+    for situacao in situacoes:
+        comentarios_por_processo.setdefault(situacao.processo_id, []).append(
+            "Nova Situação: " + tipos_de_situacao.get(situacao.tipo_de_situacao_id).nome
+        )
+    if comentarios_por_processo:
+        transaction.on_commit(lambda: _gravar_comentarios_de_situacao(comentarios_por_processo))
+
+
+def _gravar_comentarios_de_situacao(comentarios_por_processo, tentativas=2):
+    documentos = Documento.objects.filter(processo_id__in=comentarios_por_processo.keys()).values_list(
+        "id", "processo_id"
+    )
+    system_user_id = get_system_user_id()
+    comentarios = [
+        ComentarioDocumento(documento_id=documento_id, owner_id=system_user_id, comentario=comentario)
+        for documento_id, processo_id in documentos
+        for comentario in comentarios_por_processo[processo_id]
+    ]
+    try:
+        with transaction.atomic():
+            ComentarioDocumento.objects.bulk_create(comentarios)
+            incrementar_versao(ComentarioDocumento)
+    except IntegrityError:
+        # the cached system user was removed by another process
+        invalidate_system_user_cache()
+        if tentativas <= 1:
+            raise
+        _gravar_comentarios_de_situacao(comentarios_por_processo, tentativas - 1)
+
 
 @receiver(models.signals.post_save, sender=Situcacao)
 def auto_comment_on_situacao_save(sender, instance, created, update_fields, **kwargs):
     if created:
-        _system_user = get_system_user()
-        _comentario = "Nova Situação: " + instance.tipo_de_situacao.nome
-        for documento in instance.processo.documentos.all():
-            ComentarioDocumento.objects.create(documento=documento, owner=_system_user, comentario=_comentario)
+        comentar_novas_situacoes([instance])
 
 
 def processo_id_directory_path(instance, filename):
@@ -95,9 +471,146 @@ def processo_id_directory_path(instance, filename):
     )
 
 
+def conteudo_directory_path(instance, filename):
+    # file will be uploaded to MEDIA_ROOT/documentos/sha256/<sha256 of the bytes>.<filename extension>
+    return "documentos/sha256/{0}{1}".format(instance.sha256, os.path.splitext(filename)[1].lower())
+
+
+class ConteudoDeDocumento(models.Model):
+    """
+    Bytes of a document file, stored once and shared by every `Documento`
+    with the same SHA-256. `referencias` counts those documentos, and the
+    file is removed with the last of them.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    arquivo = models.FileField(upload_to=conteudo_directory_path)
+    tamanho = models.PositiveBigIntegerField(default=0)
+    referencias = models.PositiveIntegerField(default=0)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Conteudos de documentos"
+
+    # set by referenciar_conteudo() on the instance whose bytes it wrote
+    arquivo_novo = False
+
+    def __str__(self):
+        return str(self.sha256) + " - " + str(self.referencias)
+
+    def descartar_arquivo_novo(self):
+        """
+        Removes the bytes written by referenciar_conteudo() when the
+        transaction that created the row fails, since the file does not go
+        away with the rollback.
+        """
+        if self.arquivo_novo:
+            self.arquivo.delete(save=False)
+            self.arquivo_novo = False
+
+
+def sha256_do_arquivo(arquivo):
+    sha256 = hashlib.sha256()
+    for chunk in arquivo.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _referenciar_conteudo_existente(sha256):
+    with transaction.atomic():
+        conteudo = ConteudoDeDocumento.objects.select_for_update().filter(sha256=sha256).first()
+        if conteudo:
+            ConteudoDeDocumento.objects.filter(id=conteudo.id).update(referencias=F("referencias") + 1)
+            conteudo.referencias += 1
+        return conteudo
+
+
+def referenciar_conteudo(arquivo):
+    """
+    Returns the `ConteudoDeDocumento` with the bytes of `arquivo`, a Django
+    File, with one more reference. The bytes are written only when no
+    documento has them yet.
+    """
+    sha256 = sha256_do_arquivo(arquivo)
+    conteudo = _referenciar_conteudo_existente(sha256)
+    if conteudo:
+        return conteudo
+    conteudo = ConteudoDeDocumento(sha256=sha256, tamanho=arquivo.size, referencias=1)
+    conteudo.arquivo.save(os.path.basename(arquivo.name), arquivo, save=False)
+    try:
+        with transaction.atomic():
+            conteudo.save()
+    except IntegrityError:
+        # the same bytes were stored at the same time by another request
+        conteudo.arquivo.delete(save=False)
+        return _referenciar_conteudo_existente(sha256)
+    except BaseException:
+        conteudo.arquivo.delete(save=False)
+        raise
+    conteudo.arquivo_novo = True
+    return conteudo
+
+
+def liberar_conteudo(conteudo_id):
+    """
+    Removes one reference of a `ConteudoDeDocumento`. The last one deletes
+    it, and its file once the transaction commits.
+    """
+    with transaction.atomic():
+        conteudo = ConteudoDeDocumento.objects.select_for_update().filter(id=conteudo_id).first()
+        if conteudo is None:
+            return
+        if conteudo.referencias > 1:
+            ConteudoDeDocumento.objects.filter(id=conteudo.id).update(referencias=F("referencias") - 1)
+            return
+        conteudo.delete()
+        remover_apos_commit(conteudo.arquivo.path)
+
+
+def liberar_conteudos(referencias):
+    """
+    Removes `referencias`, {conteudo id: number of references}, of several
+    `ConteudoDeDocumento` at once: one UPDATE for the ones still referenced
+    and one DELETE for the others, whose files go once the transaction
+    commits.
+    """
+    if not referencias:
+        return
+    with transaction.atomic():
+        conteudos = list(
+            ConteudoDeDocumento.objects.select_for_update()
+            .filter(id__in=referencias)
+            .order_by("id")
+            .only("id", "referencias", "arquivo")
+        )
+        restantes = [conteudo.id for conteudo in conteudos if conteudo.referencias > referencias[conteudo.id]]
+        esgotados = [conteudo for conteudo in conteudos if conteudo.referencias <= referencias[conteudo.id]]
+        if restantes:
+            ConteudoDeDocumento.objects.filter(id__in=restantes).update(
+                referencias=F("referencias")
+                - Case(*[When(id=id, then=Value(referencias[id])) for id in restantes], default=Value(0))
+            )
+        if esgotados:
+            ConteudoDeDocumento.objects.filter(id__in=[conteudo.id for conteudo in esgotados]).delete()
+            for conteudo in esgotados:
+                remover_apos_commit(conteudo.arquivo.path)
+
+
+# fields of Documento whose loaded values are kept, to handle its files without reading the row again
+CAMPOS_RASTREADOS_DOCUMENTO = ("nome", "arquivo", "conteudo")
+
+
 class Documento(models.Model):
     processo = models.ForeignKey(Processo, related_name="documentos", on_delete=models.CASCADE)
     arquivo = models.FileField(upload_to=processo_id_directory_path)
+    conteudo = models.ForeignKey(
+        ConteudoDeDocumento,
+        related_name="documentos",
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.PROTECT,
+    )
     nome = models.CharField(max_length=255)
     descricao = models.CharField(max_length=255, null=True, blank=True, default="")
     criado_em = models.DateTimeField(auto_now_add=True)
@@ -106,50 +619,269 @@ class Documento(models.Model):
     class Meta:
         ordering = ["processo", "-ultima_alteracao", "id"]
 
+    # see _guardar_valores_originais()
+    valores_originais = None
+
     def __str__(self):
         return str(self.processo) + " - " + str(self.arquivo)
 
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        # the references of the shared files change with the row
+        if settings.DOCUMENTOS_DEDUPLICADOS and self.arquivo and not self.arquivo._committed:
+            # a new file: `arquivo` points at the shared copy of its bytes
+            self.conteudo = referenciar_conteudo(self.arquivo.file)
+            self.arquivo = self.conteudo.arquivo.name
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "arquivo" in update_fields:
+                kwargs["update_fields"] = set(update_fields) | {"conteudo"}
+        try:
+            super().save(*args, **kwargs)
+        except BaseException:
+            self.descartar_arquivo_novo()
+            raise
+        self._guardar_valores_originais()
+
+    def descartar_arquivo_novo(self):
+        """
+        Removes the shared file written by the last save() for new bytes.
+        Called when the transaction around the save fails after it.
+        """
+        # the cached instance only, the row may no longer be readable
+        if Documento.conteudo.is_cached(self) and self.conteudo is not None:
+            self.conteudo.descartar_arquivo_novo()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._guardar_valores_originais()
+        return instance
+
+    def _guardar_valores_originais(self):
+        """
+        Keeps nome, arquivo and conteudo_id as they are in the database, or
+        None when one of them was deferred.
+        """
+        try:
+            self.valores_originais = {
+                "nome": self.__dict__["nome"],
+                "arquivo": str(self.__dict__["arquivo"] or ""),
+                "conteudo_id": self.__dict__["conteudo_id"],
+            }
+        except KeyError:
+            self.valores_originais = None
+
+    def nome_para_download(self):
+        if self.conteudo_id:
+            return self.nome + os.path.splitext(self.arquivo.name)[1]
+        return os.path.basename(self.arquivo.name)
+
+
+@receiver(models.signals.pre_delete, sender=Processo)
+def auto_mark_processo_on_delete(sender, instance, **kwargs):
+    """
+    Marks the processo as being deleted before its situations and
+    documentos are: the current situation is not recalculated for each
+    situation, and the references of its documentos to the shared files
+    are released together once they are gone.
+    """
+    instance._referencias_liberadas = dict(
+        Documento.objects.filter(processo_id=instance.pk, conteudo__isnull=False)
+        .order_by()
+        .values("conteudo_id")
+        .annotate(referencias=Count("id"))
+        .values_list("conteudo_id", "referencias")
+    )
+    processos_em_exclusao()[instance.pk] = instance
+
+
+@receiver(models.signals.post_delete, sender=Processo)
+def auto_delete_directory_on_processo_delete(sender, instance, **kwargs):
+    """
+    Deletes the folder of the processo files, once, after the commit. The
+    removals queued by its documentos inside the folder are skipped. Its
+    cached dossiers go with it.
+    """
+    processos_em_exclusao().pop(instance.pk, None)
+    liberar_conteudos(instance.__dict__.pop("_referencias_liberadas", None))
+    remover_diretorio_apos_commit(default_storage.path("documentos/processo_{0}".format(instance.id)))
+    remover_diretorio_apos_commit(os.path.join(settings.DOSSIE_CACHE_ROOT, "processo_{0}".format(instance.id)))
+
 
 @receiver(models.signals.post_delete, sender=Documento)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
     """
     Deletes file from filesystem
-    when corresponding `Documento` object is deleted.
+    when corresponding `Documento` object is deleted,
+    once the transaction commits.
     """
-    if instance.arquivo:
-        if os.path.isfile(instance.arquivo.path):
-            os.remove(instance.arquivo.path)
+    if instance.conteudo_id:
+        if instance.processo_id not in processos_em_exclusao():
+            liberar_conteudo(instance.conteudo_id)
+    elif instance.arquivo:
+        remover_apos_commit(instance.arquivo.path)
 
 
 @receiver(models.signals.pre_save, sender=Documento)
 def auto_delete_file_on_change(sender, instance, **kwargs):
-
     """
     Deletes old file from filesystem
     when corresponding `Documento` object is updated
-    with new file.
+    with new file, once the transaction commits.
     """
     if not instance.pk:
         return False
 
-    try:
-        old_document = Documento.objects.get(pk=instance.pk)
-    except Documento.DoesNotExist:
-        return False
-
-    old_file = old_document.arquivo
-    new_file = instance.arquivo
-
-    if (not old_document.nome == instance.nome) and (old_file == new_file):
-        dirpath = os.path.dirname(old_document.arquivo.path)
-        old_file_name = os.path.basename(old_document.arquivo.path)
+    originais = instance.valores_originais
+    if originais is None:
+        # not loaded from the database, or loaded without the tracked fields
+        old_document = Documento.objects.filter(pk=instance.pk).only(*CAMPOS_RASTREADOS_DOCUMENTO).first()
+        if old_document is None:
+            return False
+        originais = old_document.valores_originais
+
+    if originais["conteudo_id"]:
+        # the file is shared, renames only change the row and a replaced
+        # content is released once the row no longer points at it
+        if originais["conteudo_id"] != instance.conteudo_id:
+            instance._conteudo_substituido_id = originais["conteudo_id"]
+        return
+
+    old_file = originais["arquivo"]
+    new_file = instance.arquivo.name
+    if old_file == new_file and originais["nome"] == instance.nome:
+        return
+    if not old_file:
+        return
+
+    old_path = instance.arquivo.storage.path(old_file)
+    if (not originais["nome"] == instance.nome) and (old_file == new_file):
+        dirpath = os.path.dirname(old_path)
+        old_file_name = os.path.basename(old_path)
         new_file_name = old_file_name[0:20] + instance.nome + os.path.splitext(old_file_name)[1]
-        os.rename(os.path.join(dirpath, old_file_name), os.path.join(dirpath, new_file_name))
-        instance.arquivo.name = "documentos/processo_{0}/{1}".format(instance.processo.id, new_file_name)
+        renomear_apos_commit(os.path.join(dirpath, old_file_name), os.path.join(dirpath, new_file_name))
+        instance.arquivo.name = "documentos/processo_{0}/{1}".format(instance.processo_id, new_file_name)
 
     if not old_file == new_file:
-        if os.path.isfile(old_file.path):
-            os.remove(old_file.path)
+        remover_apos_commit(old_path)
+
+
+class EnvioDeDocumento(models.Model):
+    """
+    Chunked upload of a `Documento`. The parts are appended, in order, to
+    a temporary file in UPLOAD_TEMP_ROOT, and the Documento is created
+    from it when the upload is finalized.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name="envios_de_documentos", on_delete=models.CASCADE)
+    processo = models.ForeignKey(Processo, related_name="envios_de_documentos", on_delete=models.CASCADE)
+    nome = models.CharField(max_length=255)
+    descricao = models.CharField(max_length=255, null=True, blank=True, default="")
+    nome_do_arquivo = models.CharField(max_length=255)
+    tamanho = models.PositiveBigIntegerField(null=True, blank=True)
+    recebido = models.PositiveBigIntegerField(default=0, editable=False)
+    partes = models.PositiveIntegerField(default=0, editable=False)
+    crc32 = models.PositiveBigIntegerField(default=0, editable=False)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    ultima_alteracao = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["criado_em", "id"]
+        verbose_name_plural = "Envios de documentos"
+
+    def __str__(self):
+        return str(self.processo) + " - " + str(self.nome_do_arquivo)
+
+    def caminho_temporario(self):
+        return os.path.join(settings.UPLOAD_TEMP_ROOT, str(self.id))
+
+
+@receiver(models.signals.post_delete, sender=EnvioDeDocumento)
+def auto_delete_temp_file_on_delete(sender, instance, **kwargs):
+    remover_apos_commit(instance.caminho_temporario())
+
+
+def tarefa_directory_path(instance, filename):
+    return "tarefas/{0}/{1}".format(instance.id, filename)
+
+
+class Tarefa(models.Model):
+    """
+    Job run by the `processar_tarefas` workers instead of the request, see
+    api.tarefas. The workers claim the pending ones with SELECT ... FOR
+    UPDATE SKIP LOCKED, and keep `ultima_alteracao` current while running.
+    """
+
+    PENDENTE = "pendente"
+    EXECUTANDO = "executando"
+    CONCLUIDA = "concluida"
+    FALHOU = "falhou"
+    ESTADOS = (
+        (PENDENTE, "Pendente"),
+        (EXECUTANDO, "Executando"),
+        (CONCLUIDA, "Concluída"),
+        (FALHOU, "Falhou"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name="tarefas", on_delete=models.CASCADE)
+    tipo = models.CharField(max_length=50)
+    parametros = models.JSONField(default=dict, blank=True)
+    # file sent with the job, such as the spreadsheet of an import
+    entrada = models.FileField(upload_to=tarefa_directory_path, blank=True, default="")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDENTE)
+    progresso = models.PositiveBigIntegerField(default=0)
+    total = models.PositiveBigIntegerField(null=True, blank=True)
+    resultado = models.JSONField(null=True, blank=True)
+    # file produced by the job, such as an exported spreadsheet
+    arquivo = models.FileField(upload_to=tarefa_directory_path, blank=True, default="")
+    erro = models.TextField(blank=True, default="")
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+    ultima_alteracao = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["criado_em", "id"]
+        indexes = [models.Index(fields=["estado", "criado_em"], name="tarefa_estado_criado_em_idx")]
+
+    def __str__(self):
+        return str(self.tipo) + " - " + str(self.estado)
+
+
+@receiver(models.signals.post_delete, sender=Tarefa)
+def auto_delete_directory_on_tarefa_delete(sender, instance, **kwargs):
+    remover_diretorio_apos_commit(default_storage.path("tarefas/{0}".format(instance.id)))
+
+
+@receiver(models.signals.post_save, sender=Documento)
+def gerar_previews_on_upload(sender, instance, created, **kwargs):
+    """
+    Queues the preview of a new file once the transaction commits. The
+    previews of a shared content are made once.
+    """
+    originais = instance.valores_originais
+    if not instance.arquivo or (originais is not None and originais["arquivo"] == instance.arquivo.name):
+        return
+    path = instance.arquivo.path
+    transaction.on_commit(lambda: fila_de_previews.agendar(path, _previews_gerados))
+
+
+def _previews_gerados():
+    # in a thread of the preview pool: the documentos now have preview URLs, their ETags change
+    try:
+        incrementar_versao(Documento)
+    finally:
+        connection.close()
+
+
+@receiver(models.signals.post_save, sender=Documento)
+def liberar_conteudo_substituido(sender, instance, **kwargs):
+    conteudo_id = instance.__dict__.pop("_conteudo_substituido_id", None)
+    if conteudo_id:
+        liberar_conteudo(conteudo_id)
 
 
 class ComentarioDocumento(models.Model):
@@ -163,3 +895,13 @@ class ComentarioDocumento(models.Model):
 
     def __str__(self):
         return str(self.id) + " - " + str(self.documento)
+
+
+def incrementar_versao_on_change(sender, instance, **kwargs):
+    incrementar_versao(sender)
+
+
+# tables whose VersaoDeTabela is kept, used by the count cache and the conditional GETs
+for _model in (Processo, Tipo_de_situacao, Situcacao, Documento, ComentarioDocumento):
+    models.signals.post_save.connect(incrementar_versao_on_change, sender=_model)
+    models.signals.post_delete.connect(incrementar_versao_on_change, sender=_model)
@@ -0,0 +1,135 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageOps
+from PyPDF2 import PdfFileReader, filters
+
+from api.arquivos import SUFIXO_PREVIEW, SUFIXO_THUMBNAIL
+
+THUMBNAIL_SIZE = (200, 200)
+PREVIEW_SIZE = (1024, 1024)
+
+IMAGE_EXTENSIONS = {".bmp", ".gif", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp"}
+
+# color spaces of the PDF images stored as raw pixels
+PDF_IMAGE_MODES = {"/DeviceRGB": "RGB", "/DeviceGray": "L", "/DeviceCMYK": "CMYK"}
+
+PDF_FILTERS = {
+    "/ASCII85Decode": filters.ASCII85Decode,
+    "/ASCIIHexDecode": filters.ASCIIHexDecode,
+    "/FlateDecode": filters.FlateDecode,
+    "/LZWDecode": filters.LZWDecode,
+}
+
+
+def _imagem_da_primeira_pagina(path):
+    """
+    Returns the largest image drawn on the first page of the PDF at `path`,
+    or None. Scanned documents are one image per page; PDFs of text and
+    vector drawings have no image to show, as they are not rasterized here.
+    """
+    page = PdfFileReader(path, strict=False).getPage(0)
+    resources = page.get("/Resources")
+    xobjects = resources.getObject().get("/XObject") if resources else None
+    if not xobjects:
+        return None
+    imagens = [xobject.getObject() for xobject in xobjects.getObject().values()]
+    imagens = [imagem for imagem in imagens if imagem.get("/Subtype") == "/Image"]
+    if not imagens:
+        return None
+    imagem = max(imagens, key=lambda imagem: imagem["/Width"] * imagem["/Height"])
+    filtros = imagem.get("/Filter")
+    filtros = list(filtros) if isinstance(filtros, list) else [filtros]
+    parametros = imagem.get("/DecodeParms")
+    parametros = list(parametros) if isinstance(parametros, list) else [parametros] * len(filtros)
+    data = imagem._data
+    while filtros and filtros[0] not in (None, "/DCTDecode", "/JPXDecode"):
+        # a KeyError of an unsupported filter leaves the document without preview
+        data = PDF_FILTERS[filtros.pop(0)].decode(data, parametros.pop(0))
+    if filtros and filtros[0] in ("/DCTDecode", "/JPXDecode"):
+        # the stream is a JPEG or JPEG 2000 file
+        return Image.open(io.BytesIO(data))
+    modo = PDF_IMAGE_MODES.get(imagem.get("/ColorSpace"))
+    if modo and imagem.get("/BitsPerComponent") == 8:
+        return Image.frombytes(modo, (imagem["/Width"], imagem["/Height"]), data)
+    return None
+
+
+def _abrir_imagem(path):
+    extensao = os.path.splitext(path)[1].lower()
+    if extensao == ".pdf":
+        imagem = _imagem_da_primeira_pagina(path)
+    elif extensao in IMAGE_EXTENSIONS:
+        imagem = Image.open(path)
+    else:
+        return None
+    if imagem is None:
+        return None
+    imagem = ImageOps.exif_transpose(imagem)
+    return imagem.convert("RGB")
+
+
+def gerar_previews(path, sobrescrever=False):
+    """
+    Writes the preview and the thumbnail, as JPEG, next to the document file
+    at `path`. Returns True when they were written, False when the file has
+    no image to show or they already exist.
+    """
+    if not sobrescrever and os.path.isfile(path + SUFIXO_THUMBNAIL):
+        return False
+    try:
+        imagem = _abrir_imagem(path)
+    except Exception:
+        # damaged or unsupported files simply have no preview
+        return False
+    if imagem is None:
+        return False
+    for sufixo, tamanho in ((SUFIXO_PREVIEW, PREVIEW_SIZE), (SUFIXO_THUMBNAIL, THUMBNAIL_SIZE)):
+        copia = imagem.copy()
+        copia.thumbnail(tamanho, Image.LANCZOS)
+        # written under a temporary name, so a half-written image is never served
+        copia.save(path + sufixo + ".tmp", "JPEG", quality=85, optimize=True)
+        os.replace(path + sufixo + ".tmp", path + sufixo)
+    return True
+
+
+class FilaDePreviews:
+    """
+    Pool of PREVIEW_WORKERS threads, per process, that generates the
+    previews outside the requests. At most PREVIEW_MAX_PENDING files wait
+    at a time; the others are left to the `gerar_previews` command.
+    """
+
+    def __init__(self, workers, max_pendentes):
+        self.workers = workers
+        self._pendentes = threading.BoundedSemaphore(max_pendentes)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _executor_do_processo(self):
+        # created on first use, in the worker process and not in the uWSGI master
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="previews")
+            return self._executor
+
+    def agendar(self, path, ao_gerar=None):
+        """
+        Queues the previews of the file at `path`. `ao_gerar` is called, in
+        the pool thread, once they are written.
+        """
+        if self.workers <= 0 or not self._pendentes.acquire(blocking=False):
+            return False
+        future = self._executor_do_processo().submit(self._gerar, path, ao_gerar)
+        future.add_done_callback(lambda future: self._pendentes.release())
+        return True
+
+    def _gerar(self, path, ao_gerar):
+        if gerar_previews(path) and ao_gerar is not None:
+            ao_gerar()
+
+
+fila_de_previews = FilaDePreviews(settings.PREVIEW_WORKERS, settings.PREVIEW_MAX_PENDING)
@@ -0,0 +1,157 @@
+import mimetypes
+import os
+import re
+import unicodedata
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.http.response import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from api.zipstream import CHUNK_SIZE
+
+# values of PROTECTED_MEDIA_OFFLOAD
+OFFLOAD_X_ACCEL_REDIRECT = "x-accel-redirect"
+OFFLOAD_X_SENDFILE = "x-sendfile"
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileRange:
+    """
+    Read-only view of `length` bytes of `file` starting at `start`. It has
+    no `fileno()`, so the WSGI server reads it instead of sending the file
+    to the end with sendfile.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(stat):
+    # the same strong ETag as nginx, so it does not change with the offload mode
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+
+def byte_range(request, size, etag, last_modified):
+    """
+    Returns the inclusive (first, last) byte of the single range requested,
+    None when the whole file must be sent, or False when the range can not
+    be satisfied. Requests of several ranges, and invalid ones, get the
+    whole file.
+    """
+    header = request.META.get("HTTP_RANGE", "").strip()
+    match = RANGE_RE.match(header)
+    if not match or not any(match.groups()):
+        return None
+    if_range = request.META.get("HTTP_IF_RANGE", "").strip()
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+    first, last = match.groups()
+    if not first:
+        # the last `last` bytes
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first = int(first)
+        if last and int(last) < first:
+            # syntactically invalid, ignored like a missing header (RFC 7233, 3.1)
+            return None
+        last = min(int(last), size - 1) if last else size - 1
+    if first > last or first >= size:
+        return False
+    return first, last
+
+
+def content_disposition(filename):
+    """
+    `attachment` header for `filename`, which may have any character: a
+    quoted ASCII `filename` for old clients and the exact name, percent
+    encoded, in `filename*` (RFC 6266).
+    """
+    nome_ascii = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+    nome_ascii = "".join(caractere if caractere.isprintable() else "_" for caractere in nome_ascii)
+    nome_ascii = nome_ascii.replace("\\", "\\\\").replace('"', '\\"')
+    return "attachment; filename=\"%s\"; filename*=UTF-8''%s" % (nome_ascii, quote(filename, safe=""))
+
+
+def offload_header(path):
+    """
+    Returns the (header, value) that makes the web server send the file at
+    `path`, as configured by PROTECTED_MEDIA_OFFLOAD, or None when the file
+    must be sent by Django.
+    """
+    offload = settings.PROTECTED_MEDIA_OFFLOAD
+    if offload == OFFLOAD_X_ACCEL_REDIRECT:
+        relative = os.path.relpath(path, os.path.abspath(settings.MEDIA_ROOT))
+        if relative.startswith(".."):
+            return None
+        return "X-Accel-Redirect", quote(settings.PROTECTED_MEDIA_INTERNAL_URL + relative.replace(os.sep, "/"))
+    if offload == OFFLOAD_X_SENDFILE:
+        return "X-Sendfile", path
+    return None
+
+
+def sendfile_response(request, path, filename):
+    """
+    Response that sends the file at `path` as the attachment `filename`,
+    with a strong ETag and a Last-Modified from its size and mtime, and a
+    304 when the copy of the client is current.
+
+    With an offload configured, only the headers are returned and the web
+    server sends the file, freeing the worker right away. Otherwise Django
+    sends it: a single byte range gets a 206 and the whole file is handed
+    to the WSGI server's file wrapper, which uses sendfile when it can.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        header = offload_header(path)
+        content_type, encoding = mimetypes.guess_type(path)
+        content_type = content_type or "application/octet-stream"
+        if header:
+            response = HttpResponse(content_type=content_type)
+            response[header[0]] = header[1]
+        else:
+            response = _file_response(request, path, stat.st_size, content_type, etag, last_modified)
+        if response.status_code != 416:
+            response["Content-Disposition"] = content_disposition(filename)
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _file_response(request, path, size, content_type, etag, last_modified):
+    requested = byte_range(request, size, etag, last_modified)
+    if requested is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = "bytes */%d" % size
+    elif requested:
+        first, last = requested
+        response = FileResponse(FileRange(open(path, "rb"), first, last - first + 1), content_type=content_type)
+        response.status_code = 206
+        response.block_size = CHUNK_SIZE
+        response["Content-Length"] = last - first + 1
+        response["Content-Range"] = "bytes %d-%d/%d" % (first, last, size)
+    else:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+        response.block_size = CHUNK_SIZE
+    response["Accept-Ranges"] = "bytes"
+    return response
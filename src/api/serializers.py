@@ -1,13 +1,67 @@
+import os
+
 from django.contrib.auth.models import User
 from django.db import transaction
 from django_typomatic import generate_ts, ts_interface
-from rest_framework import serializers
+from rest_framework import permissions, serializers
+from rest_framework.reverse import reverse
+
+from api import models, tarefas
+from api.arquivos import SUFIXO_PREVIEW, SUFIXO_THUMBNAIL
+
+
+def parametro_lista(request, nome):
+    valor = request.query_params.get(nome, None)
+    if valor is None:
+        return None
+    return {campo.strip() for campo in valor.split(",") if campo.strip()}
+
+
+def campos_selecionados(request, campos, campos_expansiveis):
+    """
+    Names among `campos` requested with `?fields=` and `?expand=`. Without
+    both, every field is returned. The expandable fields are nested
+    representations: once either parameter is given, they are returned
+    only when listed in `expand` or in `fields`.
+    """
+    campos = set(campos)
+    fields = parametro_lista(request, "fields")
+    expand = parametro_lista(request, "expand")
+    if not fields:
+        # an empty ?fields= selects every field, like no ?fields= at all
+        fields = None
+    if fields is None and expand is None:
+        return campos
+    if fields is None:
+        fields = campos - set(campos_expansiveis)
+    return (fields | ((expand or set()) & set(campos_expansiveis))) & campos
+
 
-from api import models
+class DynamicFieldsMixin:
+    """
+    Drops the fields not selected by `campos_selecionados` in safe requests.
+    Only the serializer that receives the request in its context is trimmed,
+    nested serializers keep their fields.
+    """
+
+    expandable_fields = ()
+    # columns read by the fields that are not a column themselves, for SparseFieldsetMixin:
+    # {field name: (column names)}
+    colunas_dos_campos = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request", None)
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return
+        selecionados = campos_selecionados(request, self.fields.keys(), self.expandable_fields)
+        for nome in list(self.fields.keys()):
+            if nome not in selecionados:
+                self.fields.pop(nome)
 
 
 @ts_interface()
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = (
@@ -85,14 +139,14 @@ class ChangePasswordSerializer(serializers.Serializer):
 
 
 @ts_interface()
-class Tipo_de_situacaoSerializer(serializers.ModelSerializer):
+class Tipo_de_situacaoSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Tipo_de_situacao
         fields = "__all__"
 
 
 @ts_interface()
-class SituacaoSerializer(serializers.ModelSerializer):
+class SituacaoSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     data = serializers.DateTimeField(format="%Y-%m-%dT%H:%M")
 
     class Meta:
@@ -107,9 +161,26 @@ class SituacaoSerializer(serializers.ModelSerializer):
 
 
 @ts_interface()
-class ProcessoSerializer(serializers.ModelSerializer):
+class MudancaDeSituacaoEmLoteSerializer(serializers.Serializer):
+    tipo_de_situacao = serializers.PrimaryKeyRelatedField(queryset=models.Tipo_de_situacao.objects.all())
+    # the processos by id, or by the search params of ProcessoViewSet
+    processos = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    filtros = serializers.DictField(child=serializers.CharField(), required=False, allow_empty=False)
+    data = serializers.DateTimeField(required=False)
+    comentario = serializers.CharField(max_length=255, required=False, allow_blank=True, default="")
+
+    def validate(self, data):
+        if ("processos" in data) == ("filtros" in data):
+            raise serializers.ValidationError("Informe os processos ou os filtros.")
+        return data
+
+
+@ts_interface()
+class ProcessoSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     criado_em = serializers.DateTimeField(format="%Y-%m-%d", read_only=True)
-    ultima_situacao = SituacaoSerializer(many=False, read_only=True)
+    ultima_situacao = SituacaoSerializer(source="situacao_atual", many=False, read_only=True)
+
+    expandable_fields = ("ultima_situacao",)
 
     class Meta:
         model = models.Processo
@@ -131,7 +202,7 @@ class ProcessoSerializer(serializers.ModelSerializer):
 
 
 @ts_interface()
-class ComentarioDocumentoSerializer(serializers.ModelSerializer):
+class ComentarioDocumentoSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     criado_em = serializers.DateTimeField(format="%Y-%m-%dT%H:%M", read_only=True)
 
     class Meta:
@@ -147,10 +218,119 @@ class ComentarioDocumentoSerializer(serializers.ModelSerializer):
 
 
 @ts_interface()
-class DocumentoSerializer(serializers.ModelSerializer):
+class EnvioDeDocumentoSerializer(serializers.ModelSerializer):
+    criado_em = serializers.DateTimeField(format="%Y-%m-%dT%H:%M", read_only=True)
+
+    class Meta:
+        model = models.EnvioDeDocumento
+        fields = (
+            "id",
+            "processo",
+            "nome",
+            "descricao",
+            "nome_do_arquivo",
+            "tamanho",
+            "recebido",
+            "partes",
+            "crc32",
+            "criado_em",
+        )
+        read_only_fields = (
+            "recebido",
+            "partes",
+            "crc32",
+            "criado_em",
+        )
+
+
+@ts_interface()
+class TarefaSerializer(serializers.ModelSerializer):
+    tipo = serializers.ChoiceField(choices=sorted(tarefas.TIPOS_DE_TAREFA))
+    entrada = serializers.FileField(write_only=True, required=False)
+    resultado_url = serializers.SerializerMethodField()
+    criado_em = serializers.DateTimeField(format="%Y-%m-%dT%H:%M", read_only=True)
+    iniciado_em = serializers.DateTimeField(format="%Y-%m-%dT%H:%M", read_only=True)
+    concluido_em = serializers.DateTimeField(format="%Y-%m-%dT%H:%M", read_only=True)
+
+    def validate(self, data):
+        validar = tarefas.TIPOS_DE_TAREFA[data["tipo"]].validar
+        if validar:
+            validar(data.get("parametros") or {}, data.get("entrada"))
+        return data
+
+    def get_resultado_url(self, obj):
+        # None until the job is done
+        if obj.estado != models.Tarefa.CONCLUIDA:
+            return None
+        return reverse("tarefa-resultado", args=[obj.id], request=self.context.get("request"))
+
+    class Meta:
+        model = models.Tarefa
+        fields = (
+            "id",
+            "tipo",
+            "parametros",
+            "entrada",
+            "estado",
+            "progresso",
+            "total",
+            "resultado",
+            "resultado_url",
+            "erro",
+            "tentativas",
+            "criado_em",
+            "iniciado_em",
+            "concluido_em",
+        )
+        read_only_fields = (
+            "estado",
+            "progresso",
+            "total",
+            "resultado",
+            "erro",
+            "tentativas",
+        )
+
+
+def url_do_documento(documento, sufixo=""):
+    # documentos with the same bytes share the file, the URL names the one it was read from
+    return documento.arquivo.url + sufixo + "?documento=%d" % documento.id
+
+
+class ArquivoDoDocumentoField(serializers.FileField):
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = url_do_documento(value.instance)
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+
+@ts_interface()
+class DocumentoSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    arquivo = ArquivoDoDocumentoField(max_length=100)
     comentarios = ComentarioDocumentoSerializer(many=True, read_only=True)
     criado_em = serializers.DateTimeField(format="%Y-%m-%dT%H:%M", read_only=True)
     ultima_alteracao = serializers.DateTimeField(format="%Y-%m-%dT%H:%M", read_only=True)
+    thumbnail_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+
+    expandable_fields = ("comentarios",)
+    colunas_dos_campos = {"thumbnail_url": ("arquivo",), "preview_url": ("arquivo",)}
+
+    def _url_derivada(self, obj, sufixo):
+        # None until the image is generated
+        if not obj.arquivo or not os.path.isfile(obj.arquivo.path + sufixo):
+            return None
+        url = url_do_documento(obj, sufixo)
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
+    def get_thumbnail_url(self, obj):
+        return self._url_derivada(obj, SUFIXO_THUMBNAIL)
+
+    def get_preview_url(self, obj):
+        return self._url_derivada(obj, SUFIXO_PREVIEW)
 
     class Meta:
         model = models.Documento
@@ -162,6 +342,8 @@ class DocumentoSerializer(serializers.ModelSerializer):
             "descricao",
             "criado_em",
             "ultima_alteracao",
+            "thumbnail_url",
+            "preview_url",
             "comentarios",
         )
         read_only_fields = (
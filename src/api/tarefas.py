@@ -0,0 +1,215 @@
+import os
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from api import models
+from api.exportacao import exportar_processos
+from api.importacao import importar_processos
+from api.zipstream import nomes_dos_documentos_no_zip, stream_zip
+
+# seconds between the writes of the progress of a running job
+INTERVALO_DO_MONITOR = 2
+
+
+class TipoDeTarefa:
+    def __init__(self, funcao, somente_admin, validar):
+        self.funcao = funcao
+        self.somente_admin = somente_admin
+        self.validar = validar
+
+
+# registered with @tipo_de_tarefa, by name
+TIPOS_DE_TAREFA = {}
+
+
+def tipo_de_tarefa(nome, somente_admin=False, validar=None):
+    """
+    Registers a job function under `nome`. It is called as
+    `funcao(tarefa, progresso)`, returns the JSON `resultado` and may write
+    a file with `arquivo_do_resultado()`; `progresso(done, total)` reports
+    how far it got. `validar(parametros, entrada)` checks a submission,
+    raising a ValidationError.
+    """
+
+    def registrar(funcao):
+        TIPOS_DE_TAREFA[nome] = TipoDeTarefa(funcao, somente_admin, validar)
+        return funcao
+
+    return registrar
+
+
+def submeter(owner, tipo, parametros=None, entrada=None):
+    """
+    Queues a job of `tipo`, checked with its `validar` first like the jobs
+    posted to the API, so a bad submission is a ValidationError (a 400 in
+    the views) instead of a job that fails.
+    """
+    validar = TIPOS_DE_TAREFA[tipo].validar
+    if validar:
+        validar(parametros or {}, entrada)
+    return models.Tarefa.objects.create(owner=owner, tipo=tipo, parametros=parametros or {}, entrada=entrada or "")
+
+
+def arquivo_do_resultado(tarefa, nome):
+    """Returns the path where the job writes its file, and sets it as the result."""
+    tarefa.arquivo.name = models.tarefa_directory_path(tarefa, nome)
+    path = default_storage.path(tarefa.arquivo.name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def reservar_tarefa():
+    """
+    Claims the oldest pending job, or returns None. SKIP LOCKED makes the
+    workers that look at the same time take different rows instead of
+    waiting for each other; the claim is committed right away.
+    """
+    with transaction.atomic():
+        tarefa = (
+            models.Tarefa.objects.select_for_update(skip_locked=True)
+            .filter(estado=models.Tarefa.PENDENTE)
+            .order_by("criado_em", "id")
+            .first()
+        )
+        if tarefa is None:
+            return None
+        tarefa.estado = models.Tarefa.EXECUTANDO
+        tarefa.tentativas += 1
+        tarefa.iniciado_em = timezone.now()
+        tarefa.progresso = 0
+        tarefa.total = None
+        tarefa.save(update_fields=["estado", "tentativas", "iniciado_em", "progresso", "total", "ultima_alteracao"])
+    return tarefa
+
+
+def recuperar_tarefas_abandonadas():
+    """
+    Puts back in the queue the running jobs whose worker stopped updating
+    them for TAREFA_TIMEOUT seconds, and fails the ones that already had
+    TAREFA_MAX_TENTATIVAS attempts.
+    """
+    agora = timezone.now()
+    abandonadas = models.Tarefa.objects.filter(
+        estado=models.Tarefa.EXECUTANDO, ultima_alteracao__lt=agora - timedelta(seconds=settings.TAREFA_TIMEOUT)
+    )
+    abandonadas.filter(tentativas__gte=settings.TAREFA_MAX_TENTATIVAS).update(
+        estado=models.Tarefa.FALHOU, erro="O worker parou durante a tarefa.", concluido_em=agora, ultima_alteracao=agora
+    )
+    abandonadas.update(estado=models.Tarefa.PENDENTE, ultima_alteracao=agora)
+
+
+class _Monitor(threading.Thread):
+    """
+    Writes the progress of the running job from its own connection, which
+    the pollers see even when the job runs inside a transaction, and keeps
+    its `ultima_alteracao` current while it runs.
+    """
+
+    def __init__(self, tarefa_id):
+        super().__init__(daemon=True)
+        self.tarefa_id = tarefa_id
+        self.feito = 0
+        self.total = None
+        self._parar = threading.Event()
+
+    def progresso(self, feito, total=None):
+        self.feito, self.total = feito, total
+
+    def run(self):
+        try:
+            while not self._parar.wait(INTERVALO_DO_MONITOR):
+                try:
+                    models.Tarefa.objects.filter(id=self.tarefa_id, estado=models.Tarefa.EXECUTANDO).update(
+                        progresso=self.feito, total=self.total, ultima_alteracao=timezone.now()
+                    )
+                except DatabaseError:
+                    # the database restarted, the next write opens a new connection
+                    connection.close()
+        finally:
+            connection.close()
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+def executar_tarefa(tarefa):
+    monitor = _Monitor(tarefa.id)
+    monitor.start()
+    try:
+        tarefa.resultado = TIPOS_DE_TAREFA[tarefa.tipo].funcao(tarefa, monitor.progresso)
+        tarefa.estado = models.Tarefa.CONCLUIDA
+    except Exception as e:
+        # the traceback goes to the worker log, the owner only sees the message
+        traceback.print_exc()
+        tarefa.estado = models.Tarefa.FALHOU
+        tarefa.erro = str(e) or e.__class__.__name__
+        tarefa.arquivo = ""
+    finally:
+        monitor.parar()
+    tarefa.progresso = monitor.feito
+    tarefa.total = monitor.total
+    tarefa.concluido_em = timezone.now()
+    # only while this attempt still owns the job: one that took longer than
+    # TAREFA_TIMEOUT may have been queued again and claimed by another worker
+    models.Tarefa.objects.filter(id=tarefa.id, estado=models.Tarefa.EXECUTANDO, tentativas=tarefa.tentativas).update(
+        estado=tarefa.estado,
+        resultado=tarefa.resultado,
+        arquivo=tarefa.arquivo.name or "",
+        erro=tarefa.erro,
+        progresso=tarefa.progresso,
+        total=tarefa.total,
+        concluido_em=tarefa.concluido_em,
+        ultima_alteracao=tarefa.concluido_em,
+    )
+    return tarefa
+
+
+def _validar_processo_id(parametros, entrada):
+    processo_id = parametros.get("processo_id")
+    if not str(processo_id).isdigit() or not models.Processo.objects.filter(id=processo_id).exists():
+        raise ValidationError({"parametros": "processo_id não é um processo."})
+
+
+def _validar_planilha(parametros, entrada):
+    if not entrada:
+        raise ValidationError({"entrada": "A planilha é obrigatória."})
+
+
+@tipo_de_tarefa("download_todos_processos", somente_admin=True)
+def _download_todos_processos(tarefa, progresso):
+    exportar_processos(arquivo_do_resultado(tarefa, "processos.xlsx"), progresso)
+    return None
+
+
+@tipo_de_tarefa("exportar_processos", somente_admin=True, validar=_validar_planilha)
+def _exportar_processos(tarefa, progresso):
+    return importar_processos(tarefa.entrada.path, progresso=progresso)
+
+
+@tipo_de_tarefa("download_documentos_do_processo", validar=_validar_processo_id)
+def _download_documentos_do_processo(tarefa, progresso):
+    documentos = (
+        models.Documento.objects.filter(processo__id=tarefa.parametros["processo_id"])
+        .order_by("id")
+        .only("id", "nome", "arquivo")
+    )
+    entries = nomes_dos_documentos_no_zip(documentos)
+
+    def entries_com_progresso():
+        for feito, entry in enumerate(entries):
+            progresso(feito, len(entries))
+            yield entry
+        progresso(len(entries), len(entries))
+
+    with open(arquivo_do_resultado(tarefa, "documentos.zip"), "wb") as output:
+        for chunk in stream_zip(entries_com_progresso()):
+            output.write(chunk)
+    return {"documentos": len(entries)}
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from api import models
+from api.sendfile import sendfile_response
+
+
+class DocumentoSaveTests(TransactionTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=self.media_root):
+            documento = models.Documento(processo=models.Processo.objects.create(), nome="documento")
+            documento.arquivo = ContentFile(b"conteudo", name="documento.txt")
+            documento.save()
+        self.documento_id = documento.id
+
+    def test_save_sem_arquivo_novo_nao_le_a_linha_de_novo(self):
+        # the tracked fields replace the SELECT of the old row: the UPDATE and the version bump
+        documento = models.Documento.objects.get(id=self.documento_id)
+        documento.descricao = "nova descrição"
+        with self.assertNumQueries(2):
+            documento.save()
+        self.assertEqual(models.Documento.objects.get(id=self.documento_id).descricao, "nova descrição")
+
+
+class DocumentoFieldsTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        processo = models.Processo.objects.create()
+        for numero in range(3):
+            documento = models.Documento(processo=processo, nome="documento %d" % numero)
+            documento.arquivo = ContentFile(b"conteudo %d" % numero, name="documento.txt")
+            documento.save()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="usuario"))
+
+    def test_campos_calculados_nao_consultam_por_linha(self):
+        # the versions and the documentos, whatever the number of rows
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/documento/", {"fields": "id,thumbnail_url,preview_url"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [set(documento) for documento in response.json()], [{"id", "thumbnail_url", "preview_url"}] * 3
+        )
+
+    def test_fields_vazio_retorna_todos_os_campos(self):
+        response = self.client.get("/api/documento/", {"fields": ""})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("arquivo", response.json()[0])
+        self.assertIn("comentarios", response.json()[0])
+
+
+@override_settings(PROTECTED_MEDIA_OFFLOAD="")
+class SendfileTests(SimpleTestCase):
+    def setUp(self):
+        arquivo = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+        arquivo.write(b"0123456789" * 10)
+        arquivo.close()
+        self.addCleanup(os.remove, arquivo.name)
+        self.path = arquivo.name
+
+    def get(self, intervalo="", filename="arquivo.txt"):
+        response = sendfile_response(RequestFactory().get("/", HTTP_RANGE=intervalo), self.path, filename)
+        self.addCleanup(response.close)
+        return response
+
+    def test_intervalo_valido_retorna_206(self):
+        response = self.get("bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+
+    def test_intervalo_invalido_retorna_o_arquivo_inteiro(self):
+        response = self.get("bytes=20-10")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b"".join(response.streaming_content)), 100)
+
+    def test_intervalo_apos_o_fim_retorna_416(self):
+        response = self.get("bytes=100-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+
+    def test_nome_do_arquivo_com_espacos_aspas_e_acentos(self):
+        response = self.get(filename='Relatório "final"; v2.txt')
+        self.assertEqual(
+            response["Content-Disposition"],
+            'attachment; filename="Relatorio \\"final\\"; v2.txt"; '
+            "filename*=UTF-8''Relat%C3%B3rio%20%22final%22%3B%20v2.txt",
+        )
@@ -11,6 +11,8 @@ router.register(r"tipodesituacao", viewsets.Tipo_de_situacaoViewSet, "tipodesitu
 router.register(r"situacao", viewsets.SituacaoViewSet, "situacao")
 router.register(r"documento", viewsets.DocumentoViewSet, "documento")
 router.register(r"comentario", viewsets.ComentarioDocumentoViewSet, "comentario")
+router.register(r"enviodedocumento", viewsets.EnvioDeDocumentoViewSet, "enviodedocumento")
+router.register(r"tarefa", viewsets.TarefaViewSet, "tarefa")
 
 urlpatterns = [
     path(r"auth/login/", generics.LoginView.as_view(), name="knox_login"),
@@ -18,6 +20,8 @@ urlpatterns = [
     path(r"changepassword/", generics.ChangePasswordView.as_view()),
     path(r"changetipodesituacaoordem/", generics.ChangeTipoDeSituacaoOrdemView.as_view()),
     path(r"download_documentos_do_processo/", generics.downloadDocumentsFromProcesso.as_view()),
+    path(r"download_dossie_do_processo/", generics.downloadDossieDoProcesso.as_view()),
+    path(r"processos_do_cpf_cnpj/", generics.processosDoCpfCnpj.as_view()),
     path(r"download_todos_processos/", generics.downloadTodosProcessos.as_view()),
     path(r"exportar_processos/", generics.exportarProcessos.as_view()),
 ]
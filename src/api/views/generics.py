@@ -1,36 +1,47 @@
-from datetime import datetime
+import binascii
 import os
-import zipfile
-from io import BytesIO
+import tempfile
+from hmac import compare_digest
 
-from django.utils import timezone
-
-import xlsxwriter
-from api import models, serializers
+from api import models, serializers, tarefas
 from django.contrib.auth.models import User
-from django.db.models import F
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import Count
+from django.http import StreamingHttpResponse
 from django.http.response import FileResponse, Http404
 from django.shortcuts import get_object_or_404
-from knox.auth import TokenAuthentication
 from knox.crypto import hash_token
 from knox.models import AuthToken
+from knox.settings import CONSTANTS
 from knox.views import LoginView as KnoxLoginView
 from rest_framework import generics, permissions, status, views
 from rest_framework.authentication import BasicAuthentication, get_authorization_header
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.parsers import FormParser, MultiPartParser
-from openpyxl import load_workbook
+from api.arquivos import SUFIXOS_DERIVADOS
+from api.authentication import TokenAuthentication
+from api.dossies import dossie_do_processo
+from api.exportacao import exportar_processos
+from api.importacao import importar_processos
+from api.sendfile import sendfile_response
+from api.zipstream import nomes_dos_documentos_no_zip, stream_zip
 
 
 def select_token_instance(request):
     auth = get_authorization_header(request).split()
+    if len(auth) != 2:
+        return None, None
     token = auth[1].decode()
-    if token is not None:
-        for auth_token in AuthToken.objects.filter(user=request.user):
+    if isinstance(request.auth, AuthToken):
+        return token, request.auth
+    for auth_token in AuthToken.objects.filter(user=request.user, token_key=token[: CONSTANTS.TOKEN_KEY_LENGTH]):
+        try:
             digest = hash_token(token, auth_token.salt)
-            if digest == auth_token.digest:
-                return token, auth_token
+        except (TypeError, binascii.Error):
+            return None, None
+        if compare_digest(digest, auth_token.digest):
+            return token, auth_token
     return None, None
 
 
@@ -86,36 +97,45 @@ class ChangeTipoDeSituacaoOrdemView(generics.RetrieveAPIView):
     serializer_class = serializers.Tipo_de_situacaoSerializer
 
     def get(self, request, *args, **kwargs):
-        tipo_de_situacao_id = self.request.query_params.get("tipo_de_situacao_id", None)
-        ordem_anterior = self.request.query_params.get("ordem_anterior", None)
-        ordem_nova = self.request.query_params.get("ordem_nova", None)
-
-        if tipo_de_situacao_id and ordem_anterior and ordem_nova:
-            tipo_de_situacao = get_object_or_404(models.Tipo_de_situacao, id=tipo_de_situacao_id)
-            tipo_de_situacao.ordem = 0
-            tipo_de_situacao.save()
-
-            if ordem_nova > ordem_anterior:
-                tipos_de_situacoes = models.Tipo_de_situacao.objects.filter(
-                    ordem__range=(ordem_anterior, ordem_nova)
-                ).all()
-                tipos_de_situacoes.update(ordem=F("ordem") - 1)
-
-            if ordem_anterior > ordem_nova:
-                tipos_de_situacoes = models.Tipo_de_situacao.objects.filter(
-                    ordem__range=(ordem_nova, ordem_anterior)
-                ).all()
-                tipos_de_situacoes.update(ordem=F("ordem") + 1)
-
-            tipo_de_situacao.ordem = ordem_nova
-            tipo_de_situacao.save()
-
-            queryset = models.Tipo_de_situacao.objects.all()
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
-        else:
+        try:
+            tipo_de_situacao_id = int(self.request.query_params["tipo_de_situacao_id"])
+            ordem_anterior = int(self.request.query_params["ordem_anterior"])
+            ordem_nova = int(self.request.query_params["ordem_nova"])
+        except (KeyError, ValueError):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
+        with transaction.atomic():
+            # locked in id order, like reordenar_tipos_de_situacao(), so both wait for each other
+            ids = list(models.Tipo_de_situacao.objects.select_for_update().order_by("id").values_list("id", flat=True))
+            if tipo_de_situacao_id not in ids:
+                raise Http404
+            # moves the type from its current position, ordem_anterior is no longer needed
+            ids = [
+                id
+                for id in models.Tipo_de_situacao.objects.order_by("ordem", "nome", "id").values_list("id", flat=True)
+                if id != tipo_de_situacao_id
+            ]
+            ids.insert(min(max(ordem_nova, 1), len(ids) + 1) - 1, tipo_de_situacao_id)
+            models.reordenar_tipos_de_situacao(ids)
+
+        queryset = models.Tipo_de_situacao.objects.all()
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    def post(self, request, *args, **kwargs):
+        """Applies the whole order at once, from {"ids": [ids of the situation types in the new order]}."""
+        ids = request.data.get("ids") if isinstance(request.data, dict) else None
+        if not isinstance(ids, list) or not all(isinstance(id, int) for id in ids):
+            return Response(
+                {"ids": "Informe a lista de ids dos tipos de situação."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            models.reordenar_tipos_de_situacao(ids)
+        except models.OrdemInvalida as e:
+            return Response({"ids": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(models.Tipo_de_situacao.objects.all(), many=True)
+        return Response(serializer.data)
+
 
 class serve_protected_document(generics.RetrieveAPIView):
     model = models.Documento
@@ -125,17 +145,34 @@ class serve_protected_document(generics.RetrieveAPIView):
     def get(self, request, *args, **kwargs):
         folder = self.kwargs.get("folder")
         file = self.kwargs.get("file")
-        document = get_object_or_404(models.Documento, arquivo="documentos/" + folder + "/" + file)
-        path, file_name = os.path.split(file)
-        if os.path.isfile(document.arquivo.path):
-            response = FileResponse(
-                document.arquivo,
-            )
-            response["Content-Disposition"] = "attachment; filename=" + file_name
-            return response
+        sufixo = ""
+        for derivado in SUFIXOS_DERIVADOS:
+            if file.endswith(derivado):
+                # the preview or the thumbnail of the document
+                sufixo, file = derivado, file[: -len(derivado)]
+        documentos = models.Documento.objects.filter(arquivo="documentos/" + folder + "/" + file)
+        documento_id = self.request.query_params.get("documento", "")
+        if documento_id.isdigit():
+            # documentos with the same content share the file, the download is named after this one
+            documentos = documentos.filter(id=documento_id)
+        document = documentos.order_by("id").first()
+        if document and os.path.isfile(document.arquivo.path + sufixo):
+            return sendfile_response(request, document.arquivo.path + sufixo, document.nome_para_download() + sufixo)
         raise Http404
 
 
+def assincrono(request):
+    # ?assincrono=1 submits a job instead of doing the work in the request
+    return request.query_params.get("assincrono", "").lower() in ("1", "true")
+
+
+def resposta_da_tarefa(request, tarefa):
+    serializer = serializers.TarefaSerializer(tarefa, context={"request": request})
+    response = Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+    response["Location"] = reverse("tarefa-detail", args=[tarefa.id], request=request)
+    return response
+
+
 class downloadDocumentsFromProcesso(generics.RetrieveAPIView):
     model = models.Documento
     permission_classes = [permissions.IsAuthenticated]
@@ -143,75 +180,89 @@ class downloadDocumentsFromProcesso(generics.RetrieveAPIView):
 
     def get(self, request, *args, **kwargs):
         processo_id = self.request.query_params.get("processo_id", None)
+        if processo_id and assincrono(request):
+            if not processo_id.isdigit():
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            tarefa = tarefas.submeter(
+                request.user, "download_documentos_do_processo", {"processo_id": int(processo_id)}
+            )
+            return resposta_da_tarefa(request, tarefa)
         if processo_id:
-            filePaths = []
-            queryset = models.Documento.objects.distinct().filter(processo__id=processo_id)
-            for documento in queryset.all():
-                filePaths.append(documento.arquivo.path)
-                print(os.path.basename(documento.arquivo.path))
-                print(os.path.splitext(documento.arquivo.path)[1])
-            zip_subdir = "documentos"
-            zip_filename = "%s.zip" % zip_subdir
-            # with ZipFile('sample2.zip', 'w') as zipObj2:
-            #     # Add multiple files to the zip
-            #     zipObj2.write('sample_file.csv')
-            s = BytesIO()
-            zf = zipfile.ZipFile(s, "w")
-            for fpath in filePaths:
-                fdir, fname = os.path.split(fpath)
-                zip_path = os.path.join(zip_subdir, fname)
-                zf.write(fpath, zip_path)
-            zf.close()
-
-            response = HttpResponse(s.getvalue(), content_type=("application/zip"))
+            queryset = (
+                models.Documento.objects.filter(processo__id=processo_id).order_by("id").only("id", "nome", "arquivo")
+            )
+            entries = nomes_dos_documentos_no_zip(queryset)
+            zip_filename = "documentos.zip"
+
+            response = StreamingHttpResponse(stream_zip(entries), content_type=("application/zip"))
             response["Content-Disposition"] = "attachment; filename=%s" % zip_filename
             return response
 
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+class downloadDossieDoProcesso(generics.RetrieveAPIView):
+    model = models.Processo
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = serializers.ProcessoSerializer
+
+    def get(self, request, *args, **kwargs):
+        processo_id = self.request.query_params.get("processo_id", None)
+        if not processo_id or not processo_id.isdigit():
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        processo = get_object_or_404(models.Processo, id=processo_id)
+        # built on the first request after a change, then served from the cache
+        path = dossie_do_processo(processo)
+        return sendfile_response(request, path, "dossie_processo_%d.pdf" % processo.id)
+
+
+class processosDoCpfCnpj(generics.ListAPIView):
+    model = models.Processo
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = serializers.ProcessoSerializer
+
+    def get(self, request, *args, **kwargs):
+        cpf_cnpj = models.cpf_cnpj_somente_numeros(self.request.query_params.get("cpf_cnpj", None))
+        if not cpf_cnpj:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = models.Processo.objects.filter(cpf_cnpj_numeros=cpf_cnpj)
+        situacoes = [
+            {"tipo_de_situacao": situacao["tipo_de_situacao_atual"], "total": situacao["total"]}
+            for situacao in queryset.order_by("tipo_de_situacao_atual_id")
+            .values("tipo_de_situacao_atual")
+            .annotate(total=Count("id"))
+        ]
+        processos = queryset.select_related("situacao_atual").order_by("id")
+        serializer = self.get_serializer(processos, many=True)
+        return Response(
+            {
+                "cpf_cnpj": cpf_cnpj,
+                "total": len(serializer.data),
+                "situacoes": situacoes,
+                "processos": serializer.data,
+            }
+        )
+
+
 class downloadTodosProcessos(generics.RetrieveAPIView):
     model = models.Processo
     permission_classes = [permissions.IsAdminUser]
     serializer_class = serializers.ProcessoSerializer
 
     def get(self, request, *args, **kwargs):
+        if assincrono(request):
+            return resposta_da_tarefa(request, tarefas.submeter(request.user, "download_todos_processos"))
 
-        output = BytesIO()
-
-        book = xlsxwriter.Workbook(output)
-        sheet = book.add_worksheet("Processos")
-
-        processo_index = 1
-        sheet.write(processo_index, 1, "Data de Criação")
-        sheet.write(processo_index, 2, "Processo")
-        sheet.write(processo_index, 3, "Auto de Infração")
-        sheet.write(processo_index, 4, "Reclamante")
-        sheet.write(processo_index, 5, "Reclamada")
-        sheet.write(processo_index, 6, "CPF/CNPJ")
-        sheet.write(processo_index, 7, "Última Situação")
-        sheet.write(processo_index, 8, "Data da última situação")
-        sheet.write(processo_index, 9, "Ficha de Atendimento")
-        processo_index += 1
-        for processo in models.Processo.objects.all():
-            ultima_situacao = processo.ultima_situacao()
-            sheet.write(processo_index, 1, processo.criado_em.strftime("%d/%m/%Y %H:%M:%S"))
-            sheet.write(processo_index, 2, processo.identificacao)
-            sheet.write(processo_index, 3, processo.auto_infracao)
-            sheet.write(processo_index, 4, processo.reclamante)
-            sheet.write(processo_index, 5, processo.reclamada)
-            sheet.write(processo_index, 6, processo.cpf_cnpj)
-            if ultima_situacao:
-                sheet.write(processo_index, 7, ultima_situacao.tipo_de_situacao.nome)
-                sheet.write(processo_index, 8, ultima_situacao.data.strftime("%d/%m/%Y %H:%M:%S"))
-            sheet.write(processo_index, 9, processo.ficha_de_atendimento)
-            processo_index += 1
-        book.close()
+        # the finished workbook is streamed from a temporary file
+        output = tempfile.TemporaryFile()
+        exportar_processos(output)
 
         # construct response
         output.seek(0)
-        response = HttpResponse(
-            output.read(), content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        response = FileResponse(
+            output, content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
         response["Content-Disposition"] = "attachment; filename=test.xlsx"
 
@@ -225,71 +276,9 @@ class exportarProcessos(views.APIView):
     parser_classes = (MultiPartParser, FormParser)
 
     def put(self, request):
-        print("Iniciando exportação:")
-        file_obj = request.FILES["planilha"]
-        wb = load_workbook(file_obj)
-        sheet = wb.active
-        tipo_de_situacao_ordem = models.Tipo_de_situacao.objects.all().count() + 1
-        for row_count in range(2, sheet.max_row):
-            processo = models.Processo()
-            criado_em = sheet.cell(row=row_count, column=1).internal_value
-            if isinstance(criado_em, datetime):
-                processo.criado_em = timezone.make_aware(criado_em)
-            identificacao = sheet.cell(row=row_count, column=2).internal_value
-            if identificacao:
-                processo.identificacao = str(identificacao)
-            auto_infracao = sheet.cell(row=row_count, column=3).internal_value
-            if auto_infracao:
-                processo.auto_infracao = str(auto_infracao)
-            reclamante = sheet.cell(row=row_count, column=4).internal_value
-            if reclamante:
-                processo.reclamante = str(reclamante)
-            reclamada = sheet.cell(row=row_count, column=5).internal_value
-            if reclamada:
-                processo.reclamada = str(reclamada)
-            cpf_cnpj = sheet.cell(row=row_count, column=6).internal_value
-            if cpf_cnpj:
-                cpf_cnpj = str(cpf_cnpj)
-                # "999.999.999-99" 11
-                mask_cpf = "%s%s%s.%s%s%s.%s%s%s-%s%s"
-                # "99.999.999/9999-99" 14
-                mask_cnpj = "%s%s.%s%s%s.%s%s%s/%s%s%s%s-%s%s"
-                cpj_cnpj_onlynumbers = "".join(filter(str.isdigit, cpf_cnpj))
-                if len(cpj_cnpj_onlynumbers) == 11:
-                    cpf_cnpj = mask_cpf % tuple(cpj_cnpj_onlynumbers)
-                elif len(cpj_cnpj_onlynumbers) == 14:
-                    cpf_cnpj = mask_cnpj % tuple(cpj_cnpj_onlynumbers)
-                processo.cpf_cnpj = cpf_cnpj
-
-            ficha_de_atendimento = str(sheet.cell(row=row_count, column=9).internal_value)
-            if ficha_de_atendimento:
-                processo.ficha_de_atendimento = str(ficha_de_atendimento)
-
-            if processo.identificacao and processo.identificacao != "None":
-                print("Processo: " + processo.identificacao + " | Linha: " + str(row_count))
-                processo.save()
-                if processo.id:
-
-                    tipo_de_situacao_nome = sheet.cell(row=row_count, column=7).internal_value
-                    if tipo_de_situacao_nome:
-                        tipo_de_situacao_nome = str(tipo_de_situacao_nome)
-                        situacao_data = sheet.cell(row=row_count, column=8).internal_value
-
-                        tipo_de_situacao = models.Tipo_de_situacao.objects.filter(
-                            nome__iexact=tipo_de_situacao_nome
-                        ).first()
-                        if not tipo_de_situacao:
-                            tipo_de_situacao = models.Tipo_de_situacao.objects.create(
-                                nome=tipo_de_situacao_nome, ordem=tipo_de_situacao_ordem
-                            )
-                            tipo_de_situacao_ordem += 1
-                        if tipo_de_situacao:
-                            situacao = models.Situcacao()
-                            situacao.processo = processo
-                            situacao.tipo_de_situacao = tipo_de_situacao
-                            if isinstance(situacao_data, datetime):
-                                situacao.data = timezone.make_aware(situacao_data)
-                            situacao.save()
-
-        # do some stuff with uploaded file
-        return Response(status=204)
+        file_obj = request.FILES.get("planilha", None)
+        if not file_obj:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if assincrono(request):
+            return resposta_da_tarefa(request, tarefas.submeter(request.user, "exportar_processos", entrada=file_obj))
+        return Response(importar_processos(file_obj))
@@ -0,0 +1,94 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework import permissions
+
+from api import models
+from api.serializers import campos_selecionados
+
+
+class SparseFieldsetMixin:
+    """
+    Restricts the queryset of safe requests to the columns of the fields
+    selected with `?fields=`/`?expand=`, and joins or prefetches only the
+    relations of the selected expandable fields, as given in `expansoes`:
+    {field name: (select_related paths, prefetch_related paths)}. The
+    computed fields read the columns in the `colunas_dos_campos` of the
+    serializer; when one is not declared there, every column is loaded.
+    """
+
+    expansoes = {}
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method not in permissions.SAFE_METHODS:
+            return queryset
+
+        serializer_class = self.get_serializer_class()
+        campos = serializer_class().fields
+        selecionados = campos_selecionados(
+            self.request, campos.keys(), getattr(serializer_class, "expandable_fields", ())
+        )
+        for nome, (select_related, prefetch_related) in self.expansoes.items():
+            if nome in selecionados:
+                queryset = queryset.select_related(*select_related).prefetch_related(*prefetch_related)
+
+        colunas = {field.name for field in queryset.model._meta.concrete_fields}
+        colunas_dos_campos = getattr(serializer_class, "colunas_dos_campos", {})
+        only = {queryset.model._meta.pk.name}
+        for nome in selecionados:
+            if nome in colunas_dos_campos:
+                only.update(colunas_dos_campos[nome])
+            elif campos[nome].source in colunas:
+                only.add(campos[nome].source)
+            elif nome not in self.expansoes:
+                # deferring the columns it reads would cost a query per row
+                return queryset
+        return queryset.only(*only)
+
+
+class ConditionalGetMixin:
+    """
+    Answers list and retrieve with an ETag and a Last-Modified built from the
+    `VersaoDeTabela` of the `tabelas_versionadas`, in a single query, and
+    with 304 Not Modified, before the queryset or the serializer run, when
+    the copy of the client is still current.
+    """
+
+    tabelas_versionadas = ()
+
+    def validadores(self, request):
+        versoes = models.versoes_das_tabelas(self.tabelas_versionadas)
+        partes = [
+            self.__class__.__name__,
+            request.get_full_path(),
+            str(request.user.pk),
+            request.accepted_renderer.format,
+        ]
+        partes += ["%s:%s" % (tabela, versoes[tabela].versao) for tabela in sorted(versoes)]
+        etag = '"%s"' % hashlib.sha1("|".join(partes).encode()).hexdigest()
+        last_modified = max((versao.alterado_em for versao in versoes.values()), default=None)
+        return etag, last_modified
+
+    def resposta_condicional(self, handler, request, *args, **kwargs):
+        if not self.tabelas_versionadas:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = self.validadores(request)
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response["ETag"] = etag
+            if last_modified:
+                response["Last-Modified"] = http_date(last_modified)
+            # cached copies must always be revalidated
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.resposta_condicional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.resposta_condicional(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connection
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from api import models
+
+# query params that do not change which rows are listed
+PARAMETROS_QUE_NAO_FILTRAM = {"page", "page_size", "cursor", "paginacao", "ordering", "fields", "expand"}
+
+
+def estimar_contagem(model):
+    """Row count estimated by the Postgres planner, -1 or 0 when the table was never analyzed."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row else -1
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    """
+    Page number pagination whose count is cached per normalized set of filters,
+    until the table version changes or COUNT_CACHE_TTL expires. Unfiltered
+    lists of big tables use the planner estimate instead of COUNT(*).
+    `count_exato` tells the client which one it got.
+    """
+
+    page_size = 5
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.view = view
+        self.count_exato = True
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, queryset, page_size):
+        paginator = DjangoPaginator(queryset, page_size)
+        paginator.count = self.get_count(queryset)
+        return paginator
+
+    def get_count(self, queryset):
+        filtros = {
+            chave: sorted(valores)
+            for chave, valores in self.request.query_params.lists()
+            if chave not in PARAMETROS_QUE_NAO_FILTRAM
+        }
+        if not filtros:
+            estimativa = estimar_contagem(queryset.model)
+            if estimativa >= settings.COUNT_ESTIMATE_THRESHOLD:
+                self.count_exato = False
+                return estimativa
+
+        chave = "count:%s:%s:%d:%s" % (
+            self.view.__class__.__name__ if self.view else "",
+            queryset.model._meta.label_lower,
+            models.versao_da_tabela(queryset.model),
+            hashlib.sha1(json.dumps(filtros, sort_keys=True).encode()).hexdigest(),
+        )
+        count = cache.get(chave)
+        if count is None:
+            count = queryset.count()
+            cache.set(chave, count, settings.COUNT_CACHE_TTL)
+        return count
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data["num_pages"] = self.page.paginator.num_pages
+        response.data["count_exato"] = self.count_exato
+        return response
+
+
+class CursorResultsSetPagination(CursorPagination):
+    """
+    Keyset pagination: every page is an indexed range scan on the ordering,
+    whatever its depth, and no COUNT(*) is run.
+    The ordering is `?ordering=` among the view's `cursor_ordering_fields`.
+    """
+
+    page_size = 5
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = "id"
+    ordering_query_param = "ordering"
+
+    def get_ordering(self, request, queryset, view):
+        campos = getattr(view, "cursor_ordering_fields", ("id",))
+        ordering = request.query_params.get(self.ordering_query_param, "id")
+        if ordering.lstrip("-") not in campos:
+            ordering = "id"
+        if ordering.lstrip("-") == "id":
+            return (ordering,)
+        # id breaks the ties of non unique fields
+        return (ordering, "-id" if ordering.startswith("-") else "id")
+
+
+class CursorPaginationMixin:
+    """
+    Lets a viewset's list opt in to `CursorResultsSetPagination` with
+    `?paginacao=cursor`, or by passing `?cursor=` (empty for the first page).
+    Other requests keep using `pagination_class`.
+    """
+
+    cursor_pagination_class = CursorResultsSetPagination
+    cursor_ordering_fields = ("id",)
+
+    def usa_paginacao_por_cursor(self):
+        query_params = self.request.query_params
+        return (
+            self.cursor_pagination_class.cursor_query_param in query_params
+            or query_params.get("paginacao", None) == "cursor"
+        )
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator") and self.usa_paginacao_por_cursor():
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -1,16 +1,24 @@
 # from django.db.models.aggregates import Count
-from api import models, serializers
+import os
+
+from api import envios, models, serializers, tarefas
+from api.lookups import Normalizado
+from api.sendfile import sendfile_response
+from api.views.mixins import ConditionalGetMixin, SparseFieldsetMixin
+from api.views.pagination import CursorPaginationMixin, StandardResultsSetPagination
 from api.views.permissions import (
     IsAdminUserOrIsAuthenticatedReadOnly,
     IsAdminUserOrIsOwner,
     IsAdminUserOrIsOwnerOrIsAuthenticatedReadOnly,
 )
 from django.contrib.auth.models import User
-from django.db.models import Case, When
-from rest_framework import permissions, status, viewsets
-from rest_framework.pagination import PageNumberPagination
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import Greatest
+from rest_framework import mixins, permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
-from django.db.models import Q, Max, F
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.views import exception_handler
 
@@ -73,7 +81,7 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         return super(UserProfileViewSet, self).update(request, *args, **kwargs)
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = [
         permissions.IsAuthenticated,
     ]
@@ -94,74 +102,84 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
             ).all()
 
 
-class Tipo_de_situacaoViewSet(viewsets.ModelViewSet):
+class Tipo_de_situacaoViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     permission_classes = [
         IsAdminUserOrIsAuthenticatedReadOnly,
     ]
     serializer_class = serializers.Tipo_de_situacaoSerializer
+    tabelas_versionadas = (models.Tipo_de_situacao,)
     queryset = models.Tipo_de_situacao.objects.all()
 
+    def list(self, request, *args, **kwargs):
+        return self.resposta_condicional(self.listar_do_cache, request, *args, **kwargs)
+
+    def listar_do_cache(self, request, *args, **kwargs):
+        # the rows come from the process cache, synchronized with the table version
+        models.tipos_de_situacao.sincronizar()
+        serializer = self.get_serializer(models.tipos_de_situacao.todos(), many=True)
+        return Response(serializer.data)
+
+
+CAMPOS_DE_BUSCA_PROCESSO = (
+    "identificacao",
+    "auto_infracao",
+    "reclamante",
+    "reclamada",
+    "cpf_cnpj",
+    "ficha_de_atendimento",
+)
+FILTROS_DE_PROCESSO = CAMPOS_DE_BUSCA_PROCESSO + ("tipo_de_situacao", "q")
+
+
+def filtrar_processos(parametros):
+    """
+    Processos matching the search params of ProcessoViewSet, read from
+    `parametros`, a QueryDict or a dict.
+    """
+    queryset = models.Processo.objects
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 5
-    page_size_query_param = "page_size"
-    max_page_size = 100
+    # accent and case insensitive, served by the trigram indexes of Processo
+    for campo in CAMPOS_DE_BUSCA_PROCESSO:
+        valor = parametros.get(campo, None)
+        if valor:
+            queryset = queryset.filter(**{campo + "__normalizado__contains": Normalizado(Value(valor))})
 
-    def get_paginated_response(self, data):
-        response = super().get_paginated_response(data)
-        response.data["num_pages"] = self.page.paginator.num_pages
-        return response
+    tipo_de_situacao = parametros.get("tipo_de_situacao", None)
+    if tipo_de_situacao:
+        queryset = queryset.filter(tipo_de_situacao_atual=tipo_de_situacao)
 
+    q = parametros.get("q", None)
+    if q:
+        busca = Normalizado(Value(q))
+        condicao = Q()
+        for campo in CAMPOS_DE_BUSCA_PROCESSO:
+            condicao |= Q(**{campo + "__normalizado__contains": busca})
+        similaridades = [TrigramSimilarity(Normalizado(campo), busca) for campo in CAMPOS_DE_BUSCA_PROCESSO]
+        return queryset.filter(condicao).alias(similaridade=Greatest(*similaridades)).order_by("-similaridade", "id")
 
-class ProcessoViewSet(viewsets.ModelViewSet):
+    return queryset.order_by("id").all()
+
+
+class ProcessoViewSet(ConditionalGetMixin, SparseFieldsetMixin, CursorPaginationMixin, viewsets.ModelViewSet):
     permission_classes = [
         permissions.IsAuthenticated,
     ]
     serializer_class = serializers.ProcessoSerializer
+    tabelas_versionadas = (models.Processo, models.Situcacao)
     pagination_class = StandardResultsSetPagination
+    cursor_ordering_fields = ("id", "criado_em")
+    expansoes = {"ultima_situacao": (("situacao_atual",), ())}
 
     def get_queryset(self):
-        queryset = models.Processo.objects
-
-        identificacao = self.request.query_params.get("identificacao", None)
-        if identificacao:
-            queryset = queryset.distinct().filter(identificacao__icontains=identificacao)
-
-        auto_infracao = self.request.query_params.get("auto_infracao", None)
-        if auto_infracao:
-            queryset = queryset.distinct().filter(auto_infracao__icontains=auto_infracao)
-
-        ficha_de_atendimento = self.request.query_params.get("ficha_de_atendimento", None)
-        if ficha_de_atendimento:
-            queryset = queryset.distinct().filter(ficha_de_atendimento__icontains=ficha_de_atendimento)
-
-        reclamante = self.request.query_params.get("reclamante", None)
-        if reclamante:
-            queryset = queryset.distinct().filter(reclamante__unaccent__icontains=reclamante)
-
-        reclamada = self.request.query_params.get("reclamada", None)
-        if reclamada:
-            queryset = queryset.distinct().filter(reclamada__unaccent__icontains=reclamada)
-
-        cpf_cnpj = self.request.query_params.get("cpf_cnpj", None)
-        if cpf_cnpj:
-            queryset = queryset.distinct().filter(cpf_cnpj__unaccent__icontains=cpf_cnpj)
-
-        tipo_de_situacao = self.request.query_params.get("tipo_de_situacao", None)
-        if tipo_de_situacao:
-            queryset = (
-                queryset.distinct()
-                .annotate(max_date=Max("situacoes__data"))
-                .filter(Q(situacoes__data=F("max_date")) & Q(situacoes__tipo_de_situacao=tipo_de_situacao))
-            )
-        return queryset.order_by("id").all()
+        return filtrar_processos(self.request.query_params)
 
 
-class SituacaoViewSet(viewsets.ModelViewSet):
+class SituacaoViewSet(ConditionalGetMixin, SparseFieldsetMixin, CursorPaginationMixin, viewsets.ModelViewSet):
     permission_classes = [
         permissions.IsAuthenticated,
     ]
     serializer_class = serializers.SituacaoSerializer
+    tabelas_versionadas = (models.Situcacao,)
 
     def get_queryset(self):
         queryset = models.Situcacao.objects
@@ -173,13 +191,59 @@ class SituacaoViewSet(viewsets.ModelViewSet):
 
         return queryset.all()
 
+    @action(detail=False, methods=["post"])
+    def em_lote(self, request):
+        """
+        Adds the same situation to many processos at once, given by id in
+        `processos` or by the search params of ProcessoViewSet in `filtros`,
+        and tells for each processo the situation created, and whether it
+        became the current one, or why none was.
+        """
+        serializer = serializers.MudancaDeSituacaoEmLoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        dados = serializer.validated_data
+        if "filtros" in dados:
+            if not any(dados["filtros"].get(filtro) for filtro in FILTROS_DE_PROCESSO):
+                # no filter would move every processo
+                return Response({"filtros": ["Nenhum filtro informado."]}, status=status.HTTP_400_BAD_REQUEST)
+            processo_ids = list(filtrar_processos(dados["filtros"]).order_by("id").values_list("id", flat=True))
+        else:
+            processo_ids = list(dict.fromkeys(dados["processos"]))
+
+        situacoes = models.mudar_situacao_em_lote(
+            processo_ids, dados["tipo_de_situacao"], dados.get("data"), dados["comentario"]
+        )
+        por_processo = {situacao.processo_id: situacao for situacao in situacoes}
+        atuais = dict(models.Processo.objects.filter(id__in=por_processo).values_list("id", "situacao_atual_id"))
+        resultados = []
+        for processo_id in processo_ids:
+            situacao = por_processo.get(processo_id)
+            if situacao is None:
+                resultados.append({"processo": processo_id, "erro": "Processo não encontrado."})
+            else:
+                resultados.append(
+                    {
+                        "processo": processo_id,
+                        "situacao": situacao.id,
+                        # False when the processo has a situation with a later date
+                        "situacao_atual": atuais.get(processo_id) == situacao.id,
+                    }
+                )
+        return Response(
+            {"tipo_de_situacao": dados["tipo_de_situacao"].id, "criadas": len(situacoes), "processos": resultados}
+        )
+
 
-class ComentarioDocumentoViewSet(viewsets.ModelViewSet):
+class ComentarioDocumentoViewSet(
+    ConditionalGetMixin, SparseFieldsetMixin, CursorPaginationMixin, viewsets.ModelViewSet
+):
     permission_classes = [
         IsAdminUserOrIsOwnerOrIsAuthenticatedReadOnly,
     ]
     serializer_class = serializers.ComentarioDocumentoSerializer
+    tabelas_versionadas = (models.ComentarioDocumento,)
     queryset = models.ComentarioDocumento.objects.all()
+    cursor_ordering_fields = ("id", "criado_em")
 
     def create(self, request, *args, **kwargs):
         request.data["owner"] = request.user.id
@@ -189,12 +253,15 @@ class ComentarioDocumentoViewSet(viewsets.ModelViewSet):
         raise exception_handler.MethodNotAllowed(request.method)
 
 
-class DocumentoViewSet(viewsets.ModelViewSet):
+class DocumentoViewSet(ConditionalGetMixin, SparseFieldsetMixin, CursorPaginationMixin, viewsets.ModelViewSet):
     permission_classes = [
         permissions.IsAuthenticated,
     ]
     parser_classes = (MultiPartParser, FormParser)
     serializer_class = serializers.DocumentoSerializer
+    tabelas_versionadas = (models.Documento, models.ComentarioDocumento)
+    cursor_ordering_fields = ("id", "criado_em")
+    expansoes = {"comentarios": ((), ("comentarios",))}
 
     queryset = models.Documento.objects.all()
 
@@ -204,3 +271,82 @@ class DocumentoViewSet(viewsets.ModelViewSet):
         if processo_id:
             queryset = queryset.distinct().filter(processo__id=processo_id)
         return queryset.all()
+
+
+class EnvioDeDocumentoViewSet(
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet
+):
+    """
+    Chunked, resumable upload of a Documento: POST creates the upload,
+    PUT partes/<numero>/ sends each part as the raw request body, with its
+    optional CRC-32 in the X-CRC32 header, GET tells how far it got and
+    POST finalizar/ creates the Documento.
+    """
+
+    permission_classes = [
+        permissions.IsAuthenticated,
+    ]
+    serializer_class = serializers.EnvioDeDocumentoSerializer
+
+    def get_queryset(self):
+        return models.EnvioDeDocumento.objects.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+    @action(detail=True, methods=["put"], url_path=r"partes/(?P<numero>[0-9]+)")
+    def partes(self, request, pk=None, numero=None):
+        envio = self.get_object()
+        try:
+            tamanho = int(request.META.get("CONTENT_LENGTH") or 0)
+            crc32 = request.META.get("HTTP_X_CRC32")
+            crc32 = int(crc32) if crc32 else None
+            if not tamanho:
+                raise envios.EnvioInvalido("A parte está vazia.")
+            envio = envios.receber_parte(envio.id, int(numero), request.stream, tamanho, crc32)
+        except envios.ParteForaDeOrdem as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+        except (envios.EnvioInvalido, ValueError) as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(envio).data)
+
+    @action(detail=True, methods=["post"])
+    def finalizar(self, request, pk=None):
+        envio = self.get_object()
+        try:
+            crc32 = request.data.get("crc32")
+            documento = envios.finalizar_envio(envio.id, int(crc32) if crc32 is not None else None)
+        except (envios.EnvioInvalido, ValueError) as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = serializers.DocumentoSerializer(documento, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class TarefaViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Jobs run by the `processar_tarefas` workers: POST submits one, GET
+    polls its estado and progresso, and GET resultado/ returns its file or
+    its JSON result once it is concluida.
+    """
+
+    permission_classes = [
+        permissions.IsAuthenticated,
+    ]
+    serializer_class = serializers.TarefaSerializer
+
+    def get_queryset(self):
+        return models.Tarefa.objects.filter(owner=self.request.user).order_by("-criado_em", "-id")
+
+    def perform_create(self, serializer):
+        if tarefas.TIPOS_DE_TAREFA[serializer.validated_data["tipo"]].somente_admin and not self.request.user.is_staff:
+            raise PermissionDenied()
+        serializer.save(owner=self.request.user)
+
+    @action(detail=True, methods=["get"])
+    def resultado(self, request, pk=None):
+        tarefa = self.get_object()
+        if tarefa.estado != models.Tarefa.CONCLUIDA:
+            return Response({"detail": "A tarefa está %s." % tarefa.estado}, status=status.HTTP_409_CONFLICT)
+        if tarefa.arquivo:
+            return sendfile_response(request, tarefa.arquivo.path, os.path.basename(tarefa.arquivo.name))
+        return Response(tarefa.resultado)
@@ -0,0 +1,110 @@
+import os
+import zipfile
+
+# formats that are already compressed, deflating them again only costs CPU
+ALREADY_COMPRESSED_EXTENSIONS = {
+    ".7z",
+    ".docx",
+    ".gif",
+    ".gz",
+    ".jpeg",
+    ".jpg",
+    ".mp3",
+    ".mp4",
+    ".odp",
+    ".ods",
+    ".odt",
+    ".pdf",
+    ".png",
+    ".pptx",
+    ".rar",
+    ".webp",
+    ".xlsx",
+    ".zip",
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ZipStreamBuffer:
+    """
+    Write-only, unseekable file object used as the target of a `ZipFile`.
+    zipfile then writes data descriptors instead of seeking back, and the
+    bytes written so far can be collected with `pop()` and sent right away.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def compress_type_for(path):
+    if os.path.splitext(path)[1].lower() in ALREADY_COMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def nomes_dos_documentos_no_zip(documentos, zip_subdir="documentos"):
+    """
+    Returns (path, name inside the archive) for each documento, naming the
+    files after `Documento.nome`. Repeated names get a numeric suffix,
+    in the order the documentos are given.
+    """
+    entries = []
+    usados = set()
+    for documento in documentos:
+        path = documento.arquivo.path
+        if not os.path.isfile(path):
+            continue
+        nome = documento.nome.replace("/", "_").replace("\\", "_").strip() or str(documento.id)
+        extensao = os.path.splitext(path)[1]
+        fname = nome + extensao
+        contador = 2
+        while fname.lower() in usados:
+            fname = "%s (%d)%s" % (nome, contador, extensao)
+            contador += 1
+        usados.add(fname.lower())
+        entries.append((path, zip_subdir + "/" + fname))
+    return entries
+
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE):
+    """
+    Generates a zip archive chunk by chunk from `entries`, an iterable of
+    (path on disk, name inside the archive) tuples. Only one chunk of one
+    file is held in memory at a time.
+    """
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for path, arcname in entries:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = compress_type_for(path)
+            with open(path, "rb") as source, zf.open(zinfo, "w") as dest:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+                    dest.write(data)
+                    chunk = buffer.pop()
+                    if chunk:
+                        yield chunk
+            chunk = buffer.pop()
+            if chunk:
+                yield chunk
+    yield buffer.pop()
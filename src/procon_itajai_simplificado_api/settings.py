@@ -51,7 +51,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "knox.auth.TokenAuthentication",
+        "api.authentication.TokenAuthentication",
         "rest_framework.authentication.BasicAuthentication",
     ),
     "DEFAULT_THROTTLE_CLASSES": [
@@ -70,6 +70,21 @@ REST_KNOX = {
     "AUTO_REFRESH": True,
 }
 
+# seconds a verified token is reused by each process without a query (0 disables), see api.authentication
+TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", 60))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get("TOKEN_CACHE_MAX_SIZE", 1000))
+# fraction of TOKEN_TTL that must pass before an authenticated request rewrites the token expiry
+TOKEN_REFRESH_FRACTION = float(os.environ.get("TOKEN_REFRESH_FRACTION", 0.01))
+# tokens kept per user by the purge_auth_tokens command, the oldest are deleted
+TOKEN_MAX_PER_USER = int(os.environ.get("TOKEN_MAX_PER_USER", 10))
+
+# seconds an exact count of a paginated list is cached, see api.views.pagination
+COUNT_CACHE_TTL = int(os.environ.get("COUNT_CACHE_TTL", 300))
+# unfiltered lists of tables estimated above this many rows use the planner estimate as count
+COUNT_ESTIMATE_THRESHOLD = int(os.environ.get("COUNT_ESTIMATE_THRESHOLD", 10000))
+# seconds between checks, by each process, of the version of its Tipo_de_situacao cache, see api.models
+TIPO_DE_SITUACAO_CACHE_TTL = int(os.environ.get("TIPO_DE_SITUACAO_CACHE_TTL", 5))
+
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -158,6 +173,31 @@ MEDIA_URL = "static/media/"
 STATIC_ROOT = "static/static/"
 MEDIA_ROOT = "static/media/"
 
+# how protected documents are sent, see api.sendfile:
+# "" by Django, "x-accel-redirect" by nginx or "x-sendfile" by Apache/lighttpd/uWSGI
+PROTECTED_MEDIA_OFFLOAD = os.environ.get("PROTECTED_MEDIA_OFFLOAD", "").lower()
+# internal nginx location aliased to MEDIA_ROOT, used with x-accel-redirect
+PROTECTED_MEDIA_INTERNAL_URL = os.environ.get("PROTECTED_MEDIA_INTERNAL_URL", "/protected/")
+
+# temporary files of the chunked uploads, on the same filesystem as MEDIA_ROOT so they can be moved into it
+UPLOAD_TEMP_ROOT = os.environ.get("UPLOAD_TEMP_ROOT", os.path.join(MEDIA_ROOT, "envios"))
+# largest part accepted by a chunked upload, in bytes
+UPLOAD_CHUNK_MAX_SIZE = int(os.environ.get("UPLOAD_CHUNK_MAX_SIZE", 10 * 1024 * 1024))
+# new document files are stored once per content, in documentos/sha256/, see api.models.ConteudoDeDocumento
+DOCUMENTOS_DEDUPLICADOS = bool(int(os.environ.get("DOCUMENTOS_DEDUPLICADOS", 1)))
+# threads, per process, that generate the document previews after the uploads (0 disables), see api.previews
+PREVIEW_WORKERS = int(os.environ.get("PREVIEW_WORKERS", 1))
+# uploads waiting for a preview per process, the ones above it are left to the gerar_previews command
+PREVIEW_MAX_PENDING = int(os.environ.get("PREVIEW_MAX_PENDING", 100))
+# cached PDF dossiers of the processos, see api.dossies; inside MEDIA_ROOT so nginx can send them
+DOSSIE_CACHE_ROOT = os.environ.get("DOSSIE_CACHE_ROOT", os.path.join(MEDIA_ROOT, "dossies"))
+# jobs run at the same time by the processar_tarefas command, see api.tarefas
+TAREFA_WORKERS = int(os.environ.get("TAREFA_WORKERS", 2))
+# seconds a running job may go without news from its worker before it is queued again
+TAREFA_TIMEOUT = int(os.environ.get("TAREFA_TIMEOUT", 60))
+# attempts of a job whose worker stopped, before it fails
+TAREFA_MAX_TENTATIVAS = int(os.environ.get("TAREFA_MAX_TENTATIVAS", 3))
+
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
 # Default primary key field type